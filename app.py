@@ -1,14 +1,32 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import database as db
+import importer
 import logic
-from datetime import date, timedelta
-import time
+import profiling
+import rolling
+import watcher
+import worker
+import os
+from datetime import date, datetime, timedelta
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 # Настройка страницы
 st.set_page_config(page_title="Poker Session Tracker", layout="wide", page_icon="♠️")
 
+
+def start_profiling(fragment=False):
+    # Тайминги ведутся по сессии браузера. Перезапуск одного фрагмента — свой прогон,
+    # внутри полного прогона фрагмент продолжает общий.
+    ctx = get_script_run_ctx()
+    if ctx is not None and (not fragment or ctx.fragment_ids_this_run):
+        profiling.start_run(ctx.session_id)
+
+
+start_profiling()
+
 st.markdown(
     """
     <style>
@@ -23,25 +41,41 @@ st.markdown(
 # Инициализация БД
 db.init_db()
 
+# Фоновый пересчет дашборда после каждой записи (один поток на процесс)
+worker.start()
+
+# Автоимпорт логов покер-клиента: поток работает вне перезапусков скрипта,
+# новые сессии появляются после следующего действия в интерфейсе
+WATCH_DIR = os.environ.get("POKER_TRACKER_WATCH_DIR")
+if WATCH_DIR:
+    log_watcher = watcher.start_background(WATCH_DIR)
+
+
+# Каждая вкладка — отдельный фрагмент: взаимодействие внутри вкладки перезапускает только ее.
+# Запись в БД меняет общие данные (фильтры, остальные вкладки), поэтому после нее — полный
+# перезапуск, а сообщение об успехе переживает его через session_state.
+def flash(section, kind, message):
+    st.session_state.setdefault("flash", {}).setdefault(section, []).append((kind, message))
+
+
+def show_flash(section):
+    for kind, message in st.session_state.get("flash", {}).pop(section, []):
+        getattr(st, kind)(message)
+
+
 # --- SIDEBAR (Фильтры) ---
 st.sidebar.title("♣️ Фильтры")
 
 # Фильтр дат
 filter_period = st.sidebar.selectbox(
     "Период",
-    ["Все время", "Последние 30 дней", "Текущий год", "Выбрать даты"]
+    list(worker.PRESETS) + ["Выбрать даты"]
 )
 
-start_date = None
-end_date = None
+# Стандартные периоды считаются фоновым потоком заранее
+start_date, end_date = worker.preset_range(filter_period)
 
-if filter_period == "Последние 30 дней":
-    start_date = date.today() - timedelta(days=30)
-    end_date = date.today()
-elif filter_period == "Текущий год":
-    start_date = date(date.today().year, 1, 1)
-    end_date = date.today()
-elif filter_period == "Выбрать даты":
+if filter_period == "Выбрать даты":
     d = st.sidebar.date_input("Диапазон", [date.today() - timedelta(days=7), date.today()])
     if isinstance(d, tuple) and len(d) == 2:
         start_date, end_date = d
@@ -52,73 +86,173 @@ elif filter_period == "Выбрать даты":
         start_date = date.today()
         end_date = date.today()
 
-# Загрузка справочников для фильтров
-rooms_df = db.get_rooms()
-types_df = db.get_game_types()
+# Справочники: карты id <-> название держатся в памяти процесса, фильтры выбирают id
+rooms = db.room_registry()
+game_types = db.game_type_registry()
 
-# Фильтр по руму
-room_options = ["All"] + rooms_df['name'].tolist()
-selected_room = st.sidebar.selectbox("Покер-рум", room_options)
+# Фильтр по руму (0 — все румы, id в базе начинаются с 1)
+filter_room_id = st.sidebar.selectbox("Покер-рум", (0,) + rooms.active,
+                                      format_func=lambda i: rooms.name(i, "All")) or None
 
 # Фильтр по типу игры
-type_options = ["All"] + types_df['name'].tolist()
-selected_type = st.sidebar.selectbox("Тип игры", type_options)
-
-# --- ЗАГРУЗКА ДАННЫХ ---
-df = db.get_sessions_df()
+filter_type_id = st.sidebar.selectbox("Тип игры", (0,) + game_types.active,
+                                      format_func=lambda i: game_types.name(i, "All")) or None
 
-# Применение фильтров
-if start_date and end_date:
-    df['date_only'] = df['date'].dt.date
-    df = df[(df['date_only'] >= start_date) & (df['date_only'] <= end_date)]
-    df = df.drop(columns=['date_only'])
-
-if selected_room != "All":
-    df = df[df['room'] == selected_room]
-
-if selected_type != "All":
-    df = df[df['game_type'] == selected_type]
+if WATCH_DIR:
+    if log_watcher.last_error:
+        st.sidebar.warning(f"Автоимпорт из {WATCH_DIR}: {log_watcher.last_error}")
+    else:
+        st.sidebar.caption(f"📂 Автоимпорт из {WATCH_DIR}: {log_watcher.sessions_written} сессий")
 
+# --- ЗАГРУЗКА ДАННЫХ ---
+# Фильтры применяются в SQL, в pandas попадают только нужные строки
+session_filters = {
+    'start_date': start_date if start_date and end_date else None,
+    'end_date': end_date if start_date and end_date else None,
+    'room_id': filter_room_id,
+    'game_type_id': filter_type_id,
+}
 # --- ГЛАВНАЯ НАВИГАЦИЯ ---
 tab1, tab2, tab3 = st.tabs(["📊 Аналитика", "📝 Журнал", "⚙️ Настройки"])
 
 # ==========================
 # PAGE 1: DASHBOARD
 # ==========================
-with tab1:
+def simulation_panel(df, filters):
+    game_types = db.game_type_registry()
+    history_mix = df['game_type_id'].value_counts(normalize=True)
+    with st.form("simulation_form"):
+        s1, s2, s3 = st.columns(3)
+        horizon = s1.number_input("Сессий вперед", min_value=10, max_value=10_000,
+                                  value=logic.SIMULATION_HORIZON, step=50)
+        paths = s2.selectbox("Число путей", [10_000, 100_000, 500_000], index=1)
+        bankroll = s3.number_input("Банкролл ($)", min_value=0.0, value=0.0, step=100.0,
+                                   help="0 — без расчета риска разорения")
+        with st.expander("Доли типов игр"):
+            mix = {int(type_id): st.slider(game_types.name(type_id, "Unknown Game"), 0, 100,
+                                           int(round(share * 100)), key=f"sim_mix_{type_id}") / 100
+                   for type_id, share in history_mix.items()}
+        use_all_cores = st.checkbox("Считать на всех ядрах процессора")
+        run = st.form_submit_button("Запустить симуляцию")
+
+    signature = (tuple(filters.values()), horizon, paths, bankroll, tuple(mix.items()))
+    if run:
+        # Размеры просадок: доли банкролла или, без него, средние бай-ины
+        unit = bankroll if bankroll > 0 else float(df['buy_in'].mean()) * 40
+        downswings = tuple(round(unit * k, 2) for k in (0.25, 0.5, 1.0))
+        custom_mix = any(abs(mix[int(type_id)] - round(share, 2)) > 0.005
+                         for type_id, share in history_mix.items())
+        with st.spinner("Симуляция..."):
+            result = logic.simulate_sessions(
+                df, horizon=int(horizon), paths=int(paths), bankroll=bankroll or None,
+                downswings=downswings, mix=mix if custom_mix else None,
+                mtt_type_ids=game_types.ids_named('MTT'),
+                workers=os.cpu_count() if use_all_cores else 1)
+        st.session_state["simulation"] = (signature, result)
+
+    saved = st.session_state.get("simulation")
+    if saved is None or saved[0] != signature:
+        st.caption("Будущие сессии сэмплируются из истории за выбранный период.")
+        return
+    result = saved[1]
+    if not result.paths:
+        st.warning("Недостаточно данных для симуляции.")
+        return
+
+    with profiling.timed("chart.simulation_bands"):
+        low, q1, median, q3, high = result.bands
+        fig_sim = go.Figure([
+            go.Scatter(x=result.steps, y=high, line=dict(width=0), showlegend=False, hoverinfo="skip"),
+            go.Scatter(x=result.steps, y=low, fill='tonexty', line=dict(width=0),
+                       fillcolor='rgba(99, 110, 250, 0.15)', name="5–95%"),
+            go.Scatter(x=result.steps, y=q3, line=dict(width=0), showlegend=False, hoverinfo="skip"),
+            go.Scatter(x=result.steps, y=q1, fill='tonexty', line=dict(width=0),
+                       fillcolor='rgba(99, 110, 250, 0.35)', name="25–75%"),
+            go.Scatter(x=result.steps, y=median, line=dict(color='rgb(99, 110, 250)'), name="Медиана"),
+        ])
+        fig_sim.update_layout(title=f"Накопленная прибыль: {result.paths:,} путей на {result.horizon} сессий",
+                              xaxis_title="Сессия", yaxis_title="Profit ($)")
+        st.plotly_chart(fig_sim, use_container_width=True)
+
+    def band(values, fmt):
+        return f"{fmt.format(values[5])} … {fmt.format(values[95])}" if values else "-"
+
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Profit (медиана)", f"${result.final_profit[50]:,.2f}",
+              band(result.final_profit, "${:,.0f}"), delta_color="off")
+    m2.metric("Hourly Rate (медиана)", f"${result.hourly_rate[50]:.2f}/hr" if result.hourly_rate else "-",
+              band(result.hourly_rate, "${:.2f}"), delta_color="off")
+    m3.metric("ROI (медиана)", f"{result.roi[50]:.2f}%" if result.roi else "-",
+              band(result.roi, "{:.1f}%"), delta_color="off")
+    m4.metric("Risk of Ruin", f"{result.risk_of_ruin * 100:.2f}%" if result.risk_of_ruin is not None else "-")
+    st.caption("Вероятность просадки за горизонт: " + " · ".join(
+        f"${size:,.0f} — {p * 100:.1f}%" for size, p in result.downswings.items()))
+
+
+@st.fragment
+def dashboard_page(filters):
+    start_profiling(fragment=True)
     st.title("Аналитика сессий")
 
-    # Блок 1: KPI
-    total_profit, hourly, count, winrate = logic.calculate_kpi(df)
+    # Для стандартных периодов — снимок фонового потока, иначе расчет на месте
+    data = worker.dashboard_data(filters)
+    df = data.df
+    st.caption(f"В памяти: {db.memory_footprint(df) / 1024:,.0f} KB · {len(df)} сессий")
+
+    # Все метрики считаются за один проход по отсортированным данным
+    stats = data.stats
 
+    # Блок 1: KPI (агрегаты считаются в SQLite)
+    kpi = data.kpi
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Total Profit", f"${total_profit:,.2f}", delta_color="normal")
-    col2.metric("Hourly Rate", f"${hourly:.2f}/hr")
-    col3.metric("Total Sessions", count)
-    col4.metric("Win Rate", f"{winrate:.1f}%")
+    col1.metric("Total Profit", f"${kpi['total_profit']:,.2f}", delta_color="normal")
+    col2.metric("Hourly Rate", f"${kpi['hourly_rate']:.2f}/hr",
+                help=f"Время за компьютером: {kpi['total_hours']:,.1f} ч · за столами: {kpi['seat_hours']:,.1f} ч")
+    col3.metric("Total Sessions", kpi['total_sessions'])
+    col4.metric("Win Rate", f"{kpi['win_rate']:.1f}%")
 
     st.divider()
 
     # Блок 2: Графики
     if not df.empty:
-        # Cumulative Profit
-        df_sorted = df.sort_values(by='date')
-        df_sorted['cumulative_profit'] = df_sorted['profit'].cumsum()
+        # Cumulative Profit: читается из сохраненного баланса, без сортировки и cumsum
+        cumulative_df = data.cumulative
+
+        # Длинная история прореживается (LTTB); полное разрешение — только для выбранного отрезка
+        chart_df = cumulative_df
+        if len(cumulative_df) > logic.DOWNSAMPLE_THRESHOLD:
+            if st.toggle("Полное разрешение для выбранного диапазона", key="cum_full_resolution"):
+                first_day = cumulative_df['date'].iloc[0].date()
+                last_day = cumulative_df['date'].iloc[-1].date()
+                zoom_start, zoom_end = st.slider(
+                    "Диапазон графика",
+                    min_value=first_day,
+                    max_value=last_day,
+                    value=(max(first_day, last_day - timedelta(days=90)), last_day),
+                    key="cum_zoom",
+                )
+                day = cumulative_df['date'].dt.normalize()
+                chart_df = cumulative_df[(day >= pd.Timestamp(zoom_start)) & (day <= pd.Timestamp(zoom_end))]
+            else:
+                points = logic.downsample_lttb(cumulative_df['date'], cumulative_df['cumulative_profit'])
+                chart_df = cumulative_df.iloc[points]
+            st.caption(f"Точек на графике: {len(chart_df):,} из {len(cumulative_df):,}")
 
-        fig_cum = px.line(df_sorted, x='date', y='cumulative_profit',
-                          title="График накопленной прибыли (Cumulative Profit)",
-                          markers=True)
-        st.plotly_chart(fig_cum, use_container_width=True)
+        with profiling.timed("chart.cumulative_profit"):
+            fig_cum = px.line(chart_df, x='date', y='cumulative_profit',
+                              title="График накопленной прибыли (Cumulative Profit)",
+                              markers=len(chart_df) <= logic.DOWNSAMPLE_THRESHOLD)
+            st.plotly_chart(fig_cum, use_container_width=True)
 
         # Profit by Month
-        df_sorted['month_year'] = df_sorted['date'].dt.to_period('M').astype(str)
-        monthly_profit = df_sorted.groupby('month_year')['profit'].sum().reset_index()
+        monthly_profit = data.monthly
 
-        fig_bar = px.bar(monthly_profit, x='month_year', y='profit',
-                         title="Прибыль по месяцам",
-                         color='profit',
-                         color_continuous_scale=['red', 'green'])
-        st.plotly_chart(fig_bar, use_container_width=True)
+        with profiling.timed("chart.profit_by_month"):
+            fig_bar = px.bar(monthly_profit, x='month_year', y='profit',
+                             title="Прибыль по месяцам",
+                             color='profit',
+                             color_continuous_scale=['red', 'green'])
+            st.plotly_chart(fig_bar, use_container_width=True)
 
         # Блок 3
         c_left, c_right = st.columns(2)
@@ -126,55 +260,113 @@ with tab1:
         # Profit by Rooms
         with c_left:
             st.subheader("Profit by Room")
-            room_profit = df.groupby('room')['profit'].sum().reset_index()
-            fig_room = px.bar(
-                room_profit,
-                x='room',
-                y='profit',
-                color='profit',
-                color_continuous_scale=['red', 'green', 'green'],
-                text_auto='.2s'
-            )
-            fig_room.update_layout(coloraxis_showscale=False)
-            st.plotly_chart(fig_room, use_container_width=True)
+            room_profit = data.by_room
+            with profiling.timed("chart.profit_by_room"):
+                fig_room = px.bar(
+                    room_profit,
+                    x='room',
+                    y='profit',
+                    color='profit',
+                    color_continuous_scale=['red', 'green', 'green'],
+                    text_auto='.2s'
+                )
+                fig_room.update_layout(coloraxis_showscale=False)
+                st.plotly_chart(fig_room, use_container_width=True)
 
         # Profit by Game Types
         with c_right:
             st.subheader("Profit by Game Type")
-            type_profit = df.groupby('game_type')['profit'].sum().reset_index()
-            fig_type = px.bar(type_profit, x='game_type', y='profit', color='profit')
-            st.plotly_chart(fig_type, use_container_width=True)
+            type_profit = data.by_game_type
+            with profiling.timed("chart.profit_by_game_type"):
+                fig_type = px.bar(type_profit, x='game_type', y='profit', color='profit')
+                st.plotly_chart(fig_type, use_container_width=True)
+
+        # Скользящие метрики: смена окна берет закэшированные префиксные суммы
+        st.subheader("Скользящие метрики")
+        rc1, rc2 = st.columns(2)
+        rolling_unit = rc1.radio("Окно", ["сессий", "дней"], horizontal=True, key="rolling_unit")
+        rolling_window = rc2.number_input("Размер окна", min_value=2, max_value=100_000,
+                                          value=100 if rolling_unit == "сессий" else 30,
+                                          key=f"rolling_window_{rolling_unit}")
+        rolling_df = rolling.rolling_metrics(df, int(rolling_window),
+                                             'sessions' if rolling_unit == "сессий" else 'days', filters)
+        if rolling_df.empty:
+            st.caption("Недостаточно данных для окна такого размера.")
+        else:
+            if len(rolling_df) > logic.DOWNSAMPLE_THRESHOLD:
+                rolling_df = rolling_df.iloc[logic.downsample_lttb(rolling_df['date'], rolling_df['profit'])]
+            rolling_long = rolling_df.rename(columns={
+                'profit': 'Profit ($)', 'hourly_rate': 'Hourly Rate ($/hr)',
+                'win_rate': 'Win Rate (%)', 'std': 'Std Dev ($)',
+            }).melt(id_vars=['date', 'sessions'], var_name='metric', value_name='value')
+            with profiling.timed("chart.rolling_metrics"):
+                fig_rolling = px.line(rolling_long, x='date', y='value', facet_row='metric',
+                                      height=700, hover_data=['sessions'])
+                fig_rolling.update_yaxes(matches=None, title=None)
+                fig_rolling.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+                st.plotly_chart(fig_rolling, use_container_width=True)
 
         # Блок 4: Рекорды и доп. метрики
         st.divider()
         st.subheader("Рекорды и Статистика")
 
-        recs = logic.get_records(df)
-        streak_win, streak_loss = logic.calculate_streaks(df)
-        roi = logic.get_roi(df)
-
         r1, r2, r3, r4, r5 = st.columns(5)
-        if recs:
-            r1.metric("Best Win", f"${recs['best_win'][0]:.2f}", recs['best_win'][1])
-            r2.metric("Worst Loss", f"${recs['worst_loss'][0]:.2f}", recs['worst_loss'][1])
+        if stats.best_win:
+            r1.metric("Best Win", f"${stats.best_win[0]:.2f}", stats.best_win[1])
+            r2.metric("Worst Loss", f"${stats.worst_loss[0]:.2f}", stats.worst_loss[1])
         else:
             r1.metric("Best Win", "-")
             r2.metric("Worst Loss", "-")
 
-        r3.metric("Longest Win Streak", f"{streak_win} sessions")
-        r4.metric("Longest Loss Streak", f"{streak_loss} sessions")
-        r5.metric("Total ROI", f"{roi:.2f}%")
+        streaks = stats.streaks
+        r3.metric("Longest Win Streak", f"{streaks.longest_win.length} sessions",
+                  f"{streaks.longest_win.start_date} → {streaks.longest_win.end_date}" if streaks.longest_win.length else None,
+                  delta_color="off")
+        r4.metric("Longest Loss Streak", f"{streaks.longest_loss.length} sessions",
+                  f"{streaks.longest_loss.start_date} → {streaks.longest_loss.end_date}" if streaks.longest_loss.length else None,
+                  delta_color="off")
+        r5.metric("Total ROI", f"{kpi['roi']:.2f}%")
+
+        d1, d2, d3, d4 = st.columns(4)
+        current = streaks.current
+        if current.sign > 0:
+            d1.metric("Current Streak", f"{current.length} wins", f"с {current.start_date}", delta_color="off")
+        elif current.sign < 0:
+            d1.metric("Current Streak", f"{current.length} losses", f"с {current.start_date}", delta_color="off")
+        else:
+            d1.metric("Current Streak", "-")
+
+        drawdown = stats.drawdown
+        d2.metric("Max Drawdown", f"${drawdown.max_drawdown:,.2f}",
+                  f"{drawdown.peak_date or 'старт'} → {drawdown.trough_date}" if drawdown.max_drawdown > 0 else None,
+                  delta_color="off")
+        d3.metric("Current Drawdown", f"${drawdown.current_drawdown:,.2f}")
+        d4.metric("Longest Time Under Water",
+                  f"{drawdown.longest_underwater_sessions} sessions",
+                  f"{drawdown.longest_underwater_days} days", delta_color="off")
+
+        # Блок 5: Симуляция дисперсии (считается только по кнопке)
+        st.divider()
+        with st.expander("🎲 Симуляция дисперсии и риска разорения"):
+            simulation_panel(df, filters)
 
     else:
         st.info("Нет данных для отображения за выбранный период.")
 
 
+with tab1:
+    dashboard_page(session_filters)
+
+
 # ==========================
 # PAGE 2: LOG (Журнал)
 # ==========================
 
-with tab2:
+@st.fragment
+def journal_page(filters):
+    start_profiling(fragment=True)
     st.header("Журнал сессий")
+    show_flash("journal")
 
     # Добавление сессии
     with st.expander("➕ Добавить новую сессию", expanded=True):
@@ -184,18 +376,22 @@ with tab2:
             with col_f1:
                 input_date = st.date_input("Дата", date.today())
                 input_duration = st.number_input("Длительность (мин)", min_value=1, value=60, step=60)
+                # Время необязательно; если указано, длительность считается по нему
+                col_t1, col_t2 = st.columns(2)
+                input_start = col_t1.time_input("Начало", value=None, step=300)
+                input_end = col_t2.time_input("Конец", value=None, step=300)
 
             with col_f2:
-                if not rooms_df.empty:
-                    room_map = dict(zip(rooms_df['name'], rooms_df['id']))
-                    input_room = st.selectbox("Рум", list(room_map.keys()))
+                rooms = db.room_registry()
+                game_types = db.game_type_registry()
+                if rooms.active:
+                    input_room = st.selectbox("Рум", rooms.active, format_func=rooms.name)
                 else:
                     input_room = None
                     st.warning("Сначала добавьте покер-румы в настройках")
 
-                if not types_df.empty:
-                    type_map = dict(zip(types_df['name'], types_df['id']))
-                    input_type = st.selectbox("Тип игры", list(type_map.keys()))
+                if game_types.active:
+                    input_type = st.selectbox("Тип игры", game_types.active, format_func=game_types.name)
                 else:
                     input_type = None
                     st.warning("Сначала добавьте типы игр в настройках")
@@ -209,35 +405,82 @@ with tab2:
             submitted = st.form_submit_button("Сохранить сессию")
 
             if submitted:
-                if input_room and input_type:
+                start_time = end_time = None
+                if input_start is not None and input_end is not None:
+                    start_time = datetime.combine(input_date, input_start)
+                    end_time = datetime.combine(input_date, input_end)
+                    if end_time <= start_time:
+                        # Сессия закончилась после полуночи
+                        end_time += timedelta(days=1)
+                    input_duration = int((end_time - start_time).total_seconds() // 60)
+
+                if (input_start is None) != (input_end is None):
+                    st.error("Укажите и начало, и конец сессии (или оставьте оба пустыми).")
+                elif input_room and input_type:
                     db.add_session(
                         input_date,
-                        room_map[input_room],
-                        type_map[input_type],
+                        input_room,
+                        input_type,
                         input_buyin,
                         input_cashout,
                         input_duration,
-                        input_comment
+                        input_comment,
+                        start_time,
+                        end_time
                     )
                     profit = input_cashout - input_buyin
                     if profit > 0:
-                        st.success(f"Сессия добавлена! Профит: ${profit:.2f}")
+                        flash("journal", "success", f"Сессия добавлена! Профит: ${profit:.2f}")
                     elif -1 < profit <= 0:
-                        st.warning(f"Сессия добавлена! Профит: ${profit:.2f}")
+                        flash("journal", "warning", f"Сессия добавлена! Профит: ${profit:.2f}")
                     else:
-                        st.error(f"Сессия добавлена! Профит: ${profit:.2f}")
-                    time.sleep(1)
+                        flash("journal", "error", f"Сессия добавлена! Профит: ${profit:.2f}")
                     st.rerun()
                 else:
                     st.error("Пожалуйста, убедитесь, что Румы и Типы игр созданы в настройках.")
 
+    # Импорт истории из CSV / экспорта другого трекера
+    with st.expander("📥 Импорт сессий из CSV"):
+        st.caption("Колонки: date, room, game_type, buy_in, cash_out, duration_minutes, comments. "
+                   "Недостающие румы и типы игр будут созданы, дубликаты пропущены.")
+        uploaded = st.file_uploader("CSV файл", type=["csv"], key="import_csv")
+        if uploaded is not None and st.button("Импортировать"):
+            try:
+                with st.spinner("Импорт..."):
+                    result = importer.import_sessions_csv(uploaded)
+            except Exception as e:
+                st.error(f"Ошибка импорта: {e}")
+            else:
+                flash("journal", "success",
+                      f"Добавлено {result['inserted']} из {result['rows']} строк "
+                      f"(дубликатов: {result['duplicates']}, пропущено: {result['skipped']}) "
+                      f"за {result['seconds']:.1f} с — {result['rows_per_sec']:,.0f} строк/с")
+                if result['rooms_created'] or result['game_types_created']:
+                    flash("journal", "info",
+                          "Созданы: " + ", ".join(result['rooms_created'] + result['game_types_created']))
+                st.rerun()
+
     st.divider()
 
     # Редактирование / Просмотр сессии
     st.subheader("История")
 
-    edit_df = df[
-        ['id', 'date', 'room', 'game_type', 'buy_in', 'cash_out', 'profit', 'duration_minutes', 'comments']].copy()
+    # Журнал грузится постранично (keyset по date, id) с комментариями и точными суммами.
+    # journal_keys — стек ключей начала просмотренных страниц.
+    page_size = st.selectbox("Сессий на странице", db.JOURNAL_PAGE_SIZES, index=1, key="journal_page_size")
+    journal_signature = (tuple(filters.values()), page_size)
+    if st.session_state.get("journal_signature") != journal_signature:
+        st.session_state["journal_signature"] = journal_signature
+        st.session_state["journal_keys"] = [None]
+
+    journal_keys = st.session_state["journal_keys"]
+    edit_df, next_key = db.get_sessions_page(journal_keys[-1], page_size, filters)
+
+    # Переход по страницам меняет стек в колбэке — перезапускается только фрагмент журнала
+    nav_prev, nav_info, nav_next = st.columns([1, 2, 1])
+    nav_prev.button("← Новее", disabled=len(journal_keys) == 1, on_click=journal_keys.pop)
+    nav_info.caption(f"Страница {len(journal_keys)}")
+    nav_next.button("Старше →", disabled=next_key is None, on_click=journal_keys.append, args=(next_key,))
 
     edited_data = st.data_editor(
         edit_df,
@@ -251,73 +494,80 @@ with tab2:
             "cash_out": st.column_config.NumberColumn("Cash-out", format="$%.2f"),
         },
         num_rows="dynamic",
-        key="session_editor",
+        key=f"session_editor_{len(journal_keys)}",
         use_container_width=True
     )
 
     if st.button("Применить изменения (Удалить / Изменить)"):
-        changes = st.session_state["session_editor"]
-
-        has_changes = False
-
-        if changes["deleted_rows"]:
-            for index in changes["deleted_rows"]:
-                idx = int(index)
-                if idx < len(edit_df):
-                    session_id_to_delete = edit_df.iloc[idx]['id']
-                    db.delete_session(int(session_id_to_delete))
-                    st.toast(f"🗑️ Сессия {session_id_to_delete} удалена.")
-                    has_changes = True
-
-        if changes["edited_rows"]:
-            for index_str, updates in changes["edited_rows"].items():
-                try:
-                    idx = int(index_str)
-
-                    if idx < len(edit_df):
-                        original_row = edit_df.iloc[idx]
-                        session_id = int(original_row['id'])
-                        new_date = updates.get("date", original_row["date"])
-                        if hasattr(new_date, 'strftime'):
-                            new_date = new_date.strftime('%Y-%m-%d')
-                        def safe_float(val):
-                            return float(val) if val is not None else 0.0
-
-                        def safe_int(val):
-                            return int(val) if val is not None else 0
+        changes = st.session_state[f"session_editor_{len(journal_keys)}"]
 
-                        val_buyin = updates.get("buy_in", original_row["buy_in"])
-                        new_buyin = safe_float(val_buyin)
+        def safe_float(val):
+            return float(val) if val is not None else 0.0
 
-                        val_cashout = updates.get("cash_out", original_row["cash_out"])
-                        new_cashout = safe_float(val_cashout)
+        def safe_int(val):
+            return int(val) if val is not None else 0
 
-                        val_dur = updates.get("duration_minutes", original_row["duration_minutes"])
-                        new_duration = safe_int(val_dur)
+        deletes = []
+        for index in changes["deleted_rows"]:
+            idx = int(index)
+            if idx < len(edit_df):
+                deletes.append(int(edit_df.iloc[idx]['id']))
 
-                        new_comments = updates.get("comments", original_row["comments"])
-                        if new_comments is None: new_comments = ""
+        updates = []
+        for index_str, row_updates in changes["edited_rows"].items():
+            try:
+                idx = int(index_str)
 
-                        db.update_session(session_id, new_date, new_buyin, new_cashout, new_duration, new_comments)
-                        st.toast(f"✏️ Сессия {session_id} обновлена.")
-                        has_changes = True
-                except Exception as e:
-                    st.error(f"Ошибка при обновлении строки {index_str}: {e}")
-
-        if has_changes:
-            st.success("Изменения успешно применены!")
-            time.sleep(1.5)
-            st.rerun()
+                if idx < len(edit_df):
+                    original_row = edit_df.iloc[idx]
+                    new_date = row_updates.get("date", original_row["date"])
+                    if hasattr(new_date, 'strftime'):
+                        new_date = new_date.strftime('%Y-%m-%d')
+
+                    new_comments = row_updates.get("comments", original_row["comments"])
+                    if new_comments is None: new_comments = ""
+
+                    updates.append({
+                        'id': int(original_row['id']),
+                        'date': new_date,
+                        'buy_in': safe_float(row_updates.get("buy_in", original_row["buy_in"])),
+                        'cash_out': safe_float(row_updates.get("cash_out", original_row["cash_out"])),
+                        'duration_minutes': safe_int(row_updates.get("duration_minutes", original_row["duration_minutes"])),
+                        'comments': new_comments,
+                    })
+            except Exception as e:
+                st.error(f"Ошибка при обновлении строки {index_str}: {e}")
+
+        if deletes or updates:
+            try:
+                # Одна транзакция на все удаления и правки
+                db.apply_session_changes(deletes, updates)
+            except Exception as e:
+                st.error(f"Изменения не применены: {e}")
+            else:
+                if deletes:
+                    flash("journal", "toast", f"🗑️ Удалено сессий: {len(deletes)}")
+                if updates:
+                    flash("journal", "toast", f"✏️ Обновлено сессий: {len(updates)}")
+                flash("journal", "success", "Изменения успешно применены!")
+                st.rerun()
         else:
             st.info("Нет изменений для сохранения.")
 
 
+with tab2:
+    journal_page(session_filters)
+
+
 # ==========================
 # PAGE 3: SETTINGS
 # ==========================
 
-with tab3:
+@st.fragment
+def settings_page():
+    start_profiling(fragment=True)
     st.header("Настройки справочников")
+    show_flash("settings")
     st.info("💡 Вы можете редактировать названия прямо в таблице. Нажмите 'Сохранить изменения' после правки.")
 
     col_s1, col_s2 = st.columns(2)
@@ -332,7 +582,7 @@ with tab3:
             if st.form_submit_button("Добавить рум"):
                 if new_room:
                     db.add_room(new_room)
-                    st.success(f"Рум {new_room} добавлен")
+                    flash("settings", "success", f"Рум {new_room} добавлен")
                     st.rerun()
         # Update Room
         rooms_df = db.get_rooms()
@@ -369,18 +619,18 @@ with tab3:
                             db.update_room(room_id, new_name)
                             count_updated += 1
                 if count_updated > 0:
-                    st.success(f"Обновлено записей: {count_updated}")
-                    time.sleep(1)
+                    flash("settings", "success", f"Обновлено записей: {count_updated}")
                     st.rerun()
 
         #DELETE POKER ROOM
         st.divider()
-        room_to_delete = st.selectbox("Удалить рум", ["Выберите..."] + rooms_df['name'].tolist())
+        rooms = db.room_registry()
+        room_to_delete = st.selectbox("Удалить рум", (0,) + rooms.active,
+                                      format_func=lambda i: rooms.name(i, "Выберите..."))
         if st.button("Удалить выбранный рум"):
-            if room_to_delete != "Выберите...":
-                r_id = rooms_df[rooms_df['name'] == room_to_delete].iloc[0]['id']
-                db.soft_delete_room(int(r_id))
-                st.warning(f"Рум {room_to_delete} удален.")
+            if room_to_delete:
+                db.soft_delete_room(room_to_delete)
+                flash("settings", "warning", f"Рум {rooms.name(room_to_delete)} удален.")
                 st.rerun()
 
     # GAME TYPES
@@ -393,7 +643,7 @@ with tab3:
             if st.form_submit_button("Добавить"):
                 if new_type:
                     db.add_game_type(new_type)
-                    st.success(f"Тип {new_type} добавлен")
+                    flash("settings", "success", f"Тип {new_type} добавлен")
                     st.rerun()
 
         #UPDATE GAME TYPES
@@ -430,19 +680,35 @@ with tab3:
                             db.update_game_type(type_id, new_name)
                             count_updated += 1
                 if count_updated > 0:
-                    st.success(f"Обновлено записей: {count_updated}")
-                    time.sleep(1)
+                    flash("settings", "success", f"Обновлено записей: {count_updated}")
                     st.rerun()
 
         # DELETE GAME TYPE
         st.divider()
-        type_to_delete = st.selectbox("Удалить тип", ["Выберите..."] + types_df['name'].tolist())
+        game_types = db.game_type_registry()
+        type_to_delete = st.selectbox("Удалить тип", (0,) + game_types.active,
+                                      format_func=lambda i: game_types.name(i, "Выберите..."))
         if st.button("Удалить выбранный тип"):
-            if type_to_delete != "Выберите...":
-                t_id = types_df[types_df['name'] == type_to_delete].iloc[0]['id']
-                db.soft_delete_game_type(int(t_id))
-                st.warning(f"Тип {type_to_delete} удален.")
+            if type_to_delete:
+                db.soft_delete_game_type(type_to_delete)
+                flash("settings", "warning", f"Тип {game_types.name(type_to_delete)} удален.")
                 st.rerun()
 
 
+with tab3:
+    settings_page()
+
+
+# ==========================
+# PERFORMANCE (скрытая панель: ?perf=1 в адресе)
+# ==========================
 
+if st.query_params.get("perf"):
+    with st.sidebar.expander("⏱ Performance", expanded=True):
+        items, wall_ms = profiling.last_run()
+        st.caption(f"Последний прогон: {wall_ms:,.1f} ms")
+        st.dataframe(pd.DataFrame(items), hide_index=True, use_container_width=True)
+        st.caption("Скользящие перцентили")
+        st.dataframe(pd.DataFrame(profiling.rolling_stats()), hide_index=True, use_container_width=True)
+        st.download_button("Экспорт JSON", profiling.export_json(),
+                           file_name="poker_tracker_profile.json", mime="application/json")
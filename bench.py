@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import database as db
+import logic
+
+ROOM_NAMES = ["PokerStars", "GGPoker", "888poker", "partypoker", "iPoker", "Winamax", "ACR", "CoinPoker"]
+
+# (название, доля сессий, MTT ли это)
+GAME_TYPES = [
+    ("Cash", 0.45, False),
+    ("MTT", 0.35, True),
+    ("Spin&Go", 0.15, False),
+    ("PLO Cash", 0.05, False),
+]
+
+
+def generate_db(path, sessions, rooms=4, game_types=3, years=5, seed=42):
+    # Синтетическая база: несколько сессий в игровой день, больше по выходным,
+    # у MTT редкие крупные заносы, у кеша — нормальный разброс вокруг бай-ина.
+    rng = np.random.default_rng(seed)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db.DB_NAME = path
+    db.init_db()
+
+    types = GAME_TYPES[:game_types]
+    with db.transaction() as conn:
+        room_names = [ROOM_NAMES[i % len(ROOM_NAMES)] + (f" {i // len(ROOM_NAMES) + 1}" if i >= len(ROOM_NAMES) else "")
+                      for i in range(rooms)]
+        conn.executemany("INSERT INTO rooms (name) VALUES (?)", [(name,) for name in room_names])
+        conn.executemany("INSERT INTO game_types (name) VALUES (?)", [(t[0],) for t in types])
+
+    start = date.today() - timedelta(days=365 * years)
+    days = np.arange(365 * years)
+    weekday = (start.weekday() + days) % 7
+    day_weights = np.where(weekday >= 5, 2.0, 1.0)
+    day_weights /= day_weights.sum()
+
+    shares = np.array([t[1] for t in types])
+    shares /= shares.sum()
+
+    chunk = 100_000
+    for offset in range(0, sessions, chunk):
+        n = min(chunk, sessions - offset)
+        session_days = np.sort(rng.choice(days, size=n, p=day_weights))
+        type_idx = rng.choice(len(types), size=n, p=shares)
+        is_mtt = np.array([t[2] for t in types])[type_idx]
+
+        buy_in = np.where(is_mtt,
+                          rng.choice([5.5, 11.0, 22.0, 55.0, 109.0], size=n),
+                          rng.choice([20.0, 50.0, 100.0, 200.0], size=n))
+        mtt_cash = np.where(rng.random(n) < 0.15, buy_in * rng.pareto(1.2, size=n) * 3, 0.0)
+        cash_result = np.maximum(buy_in + rng.normal(0.05, 1.0, size=n) * buy_in, 0.0)
+        cash_out = np.round(np.where(is_mtt, mtt_cash, cash_result), 2)
+        duration = np.where(is_mtt, rng.integers(60, 480, size=n), rng.integers(20, 240, size=n))
+
+        dates = [(start + timedelta(days=int(d))).isoformat() for d in session_days]
+        rows = zip(dates,
+                   rng.integers(1, rooms + 1, size=n).tolist(),
+                   (type_idx + 1).tolist(),
+                   buy_in.tolist(),
+                   cash_out.tolist(),
+                   (cash_out - buy_in).tolist(),
+                   duration.tolist(),
+                   [""] * n)
+        with db.transaction() as conn:
+            conn.executemany('''INSERT INTO sessions
+                     (date, room_id, game_type_id, buy_in, cash_out, profit, duration_minutes, comments)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+
+    db.repair_balances()
+
+
+def _timeit(func, repeat, setup=None):
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - started) * 1000)
+    rows = len(result) if hasattr(result, '__len__') else None
+    return {
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'rows': rows,
+    }
+
+
+def _filter_presets():
+    today = date.today()
+    return {
+        'all_time': {},
+        'last_30_days': {'start_date': today - timedelta(days=30), 'end_date': today},
+        'current_year': {'start_date': date(today.year, 1, 1), 'end_date': today},
+        'room': {'room_id': 1},
+        'game_type': {'game_type_id': 2},
+    }
+
+
+def run_benchmarks(repeat=5):
+    results = {}
+
+    # Холодное чтение — кэш сбрасывается перед каждым замером
+    for name, filters in _filter_presets().items():
+        results[f'get_sessions_df[{name}]'] = _timeit(
+            lambda f=filters: db.get_sessions_df(**f), repeat, setup=db.clear_cache)
+    results['get_sessions_df[all_time, cached]'] = _timeit(db.get_sessions_df, repeat)
+    for name, filters in _filter_presets().items():
+        for func in (db.get_kpi_totals, db.get_profit_by_month, db.get_profit_by_room):
+            results[f'{func.__name__}[{name}]'] = _timeit(
+                lambda f=filters, fn=func: fn(**f), repeat, setup=db.clear_cache)
+
+    df = db.get_sessions_df()
+    total_profit = df['profit'].sum()
+    results['logic.calculate_kpi'] = _timeit(lambda: logic.calculate_kpi(df), repeat)
+    results['logic.calc_hourly_rate'] = _timeit(lambda: logic.calc_hourly_rate(df, total_profit), repeat)
+    results['logic.calculate_streaks'] = _timeit(lambda: logic.calculate_streaks(df), repeat)
+    results['logic.get_records'] = _timeit(lambda: logic.get_records(df), repeat)
+    results['logic.get_roi'] = _timeit(lambda: logic.get_roi(df), repeat)
+    results['logic.compute_dashboard_stats'] = _timeit(lambda: logic.compute_dashboard_stats(df), repeat)
+    return results
+
+
+def compare(previous, current):
+    old = {(r['sessions'], name): v for r in previous['runs'] for name, v in r['results'].items()}
+    print(f"{'sessions':>9}  {'benchmark':<42} {'old ms':>10} {'new ms':>10} {'ratio':>7}")
+    for run in current['runs']:
+        for name, v in run['results'].items():
+            before = old.get((run['sessions'], name))
+            if before is None:
+                continue
+            ratio = v['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+            print(f"{run['sessions']:>9}  {name:<42} {before['median_ms']:>10.2f} {v['median_ms']:>10.2f} {ratio:>6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark database.py and logic.py on synthetic data")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1_000, 10_000, 100_000],
+                        help="размеры истории (например 1000 100000 1000000)")
+    parser.add_argument('--rooms', type=int, default=4)
+    parser.add_argument('--game-types', type=int, default=3, choices=range(1, len(GAME_TYPES) + 1))
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help="куда класть сгенерированные базы (по умолчанию временная папка)")
+    parser.add_argument('--out', help="записать результаты в JSON")
+    parser.add_argument('--compare', help="сравнить с предыдущим JSON")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="poker_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'rooms': args.rooms,
+            'game_types': args.game_types,
+            'years': args.years,
+            'repeat': args.repeat,
+        },
+        'runs': [],
+    }
+
+    for sessions in args.sessions:
+        path = os.path.join(workdir, f"poker_stats_{sessions}.db")
+        started = time.perf_counter()
+        generate_db(path, sessions, args.rooms, args.game_types, args.years, args.seed)
+        generated_s = time.perf_counter() - started
+        print(f"[{sessions} sessions] generated in {generated_s:.1f}s -> {path}", file=sys.stderr)
+
+        results = run_benchmarks(args.repeat)
+        report['runs'].append({
+            'sessions': sessions,
+            'db_path': path,
+            'generate_s': round(generated_s, 3),
+            'results': results,
+        })
+        for name, v in results.items():
+            print(f"[{sessions} sessions] {name:<42} {v['median_ms']:>10.2f} ms", file=sys.stderr)
+
+    db.close_connections()
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import time
+
+_started = time.perf_counter()
+
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date, timedelta
+
+import numpy as np
+
+import database as db
+import logic
+
+# Отчеты без Streamlit: KPI и итоги по месяцам читаются из роллапов, стрики и просадка
+# считаются по последовательности профитов. pandas и plotly здесь не импортируются.
+SECTIONS = ('kpi', 'records', 'streaks', 'drawdown', 'monthly')
+PERIODS = ('all', 'last-30-days', 'current-year')
+
+# Секции из одной строки печатаются как «поле: значение»
+SINGLE_ROW = ('kpi', 'drawdown')
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается дата YYYY-MM-DD: {value}")
+
+
+def _lookup_id(table, name):
+    with db.connection() as conn:
+        row = conn.execute(f"SELECT id FROM {table} WHERE deleted_at IS NULL AND lower(name) = lower(?) "
+                           "ORDER BY id LIMIT 1", (name.strip(),)).fetchone()
+    return row[0] if row else None
+
+
+def build_filters(args):
+    start_date = end_date = None
+    if args.period == 'last-30-days':
+        start_date = date.today() - timedelta(days=30)
+        end_date = date.today()
+    elif args.period == 'current-year':
+        start_date = date(date.today().year, 1, 1)
+        end_date = date.today()
+    if args.date_from is not None:
+        start_date = args.date_from
+    if args.date_to is not None:
+        end_date = args.date_to
+
+    filters = {'start_date': start_date, 'end_date': end_date, 'room_id': None, 'game_type_id': None}
+    if args.room:
+        filters['room_id'] = _lookup_id('rooms', args.room)
+        if filters['room_id'] is None:
+            raise SystemExit(f"Рум не найден: {args.room}")
+    if args.game_type:
+        filters['game_type_id'] = _lookup_id('game_types', args.game_type)
+        if filters['game_type_id'] is None:
+            raise SystemExit(f"Тип игры не найден: {args.game_type}")
+    return filters
+
+
+def _streak_row(name, streak):
+    return {'streak': name, 'length': streak.length,
+            'start_date': streak.start_date, 'end_date': streak.end_date}
+
+
+def build_report(filters, sections=SECTIONS):
+    # Каждая секция — список строк-словарей
+    report = {}
+    if 'kpi' in sections:
+        kpi = db.get_kpi_totals(**filters)
+        report['kpi'] = [{
+            'total_profit': round(float(kpi['total_profit']), 2),
+            'total_sessions': kpi['total_sessions'],
+            'win_rate': round(kpi['win_rate'], 2),
+            'total_hours': round(kpi['total_hours'], 2),
+            'seat_hours': round(kpi['seat_hours'], 2),
+            'hourly_rate': round(kpi['hourly_rate'], 2),
+            'roi': round(kpi['roi'], 2),
+        }]
+
+    if {'records', 'streaks', 'drawdown'} & set(sections):
+        dates, profits = db.get_profit_sequence(**filters)
+        dates = np.array(dates, dtype='int64').astype('datetime64[D]')
+        profits = np.round(np.array(profits, dtype=np.float64), 2)
+
+        if 'records' in sections:
+            report['records'] = []
+            if len(profits):
+                best, worst = int(np.argmax(profits)), int(np.argmin(profits))
+                report['records'] = [
+                    {'record': 'best_win', 'profit': float(profits[best]), 'date': str(dates[best])},
+                    {'record': 'worst_loss', 'profit': float(profits[worst]), 'date': str(dates[worst])},
+                ]
+
+        if 'streaks' in sections:
+            streaks = logic.streak_summary(profits, dates)
+            current = streaks.current
+            report['streaks'] = [
+                _streak_row('longest_win', streaks.longest_win),
+                _streak_row('longest_loss', streaks.longest_loss),
+                _streak_row({1: 'current_win', -1: 'current_loss'}.get(current.sign, 'current'), current),
+            ]
+
+        if 'drawdown' in sections:
+            drawdown = logic.drawdown_summary(np.cumsum(profits), dates)
+            report['drawdown'] = [{
+                'max_drawdown': round(drawdown.max_drawdown, 2),
+                'peak_date': drawdown.peak_date,
+                'trough_date': drawdown.trough_date,
+                'current_drawdown': round(drawdown.current_drawdown, 2),
+                'longest_underwater_sessions': drawdown.longest_underwater_sessions,
+                'longest_underwater_days': drawdown.longest_underwater_days,
+            }]
+
+    if 'monthly' in sections:
+        report['monthly'] = list(db.get_monthly_totals(**filters))
+    return report
+
+
+def render_text(report):
+    lines = []
+    for section, rows in report.items():
+        lines.append(f"== {section} ==")
+        if not rows:
+            lines.append("(нет данных)")
+        elif section in SINGLE_ROW:
+            width = max(len(key) for key in rows[0])
+            lines.extend(f"{key:<{width}}  {_format_value(value)}" for key, value in rows[0].items())
+        else:
+            columns = list(rows[0])
+            cells = [[_format_value(row[c]) for c in columns] for row in rows]
+            widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+            # Числа выравниваются вправо, текст — влево
+            justify = [str.rjust if isinstance(rows[0][c], (int, float)) else str.ljust for c in columns]
+            lines.append("  ".join(j(c, w) for c, w, j in zip(columns, widths, justify)).rstrip())
+            lines.extend("  ".join(j(v, w) for v, w, j in zip(r, widths, justify)).rstrip() for r in cells)
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    return str(value)
+
+
+def render_csv(report):
+    # Несколько секций идут блоками через пустую строку, перед блоком — имя секции
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    for i, (section, rows) in enumerate(report.items()):
+        if len(report) > 1:
+            if i:
+                writer.writerow([])
+            writer.writerow([f"# {section}"])
+        if rows:
+            writer.writerow(list(rows[0]))
+            writer.writerows([list(row.values()) for row in rows])
+    return out.getvalue()
+
+
+def render_json(report, filters):
+    payload = {'filters': {k: (v.isoformat() if isinstance(v, date) else v) for k, v in filters.items()}}
+    for section, rows in report.items():
+        payload[section] = (rows[0] if rows else None) if section in SINGLE_ROW else rows
+    return json.dumps(payload, indent=2, ensure_ascii=False)
+
+
+RENDERERS = {
+    'text': lambda report, filters: render_text(report),
+    'csv': lambda report, filters: render_csv(report),
+    'json': render_json,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Poker tracker reports without the Streamlit UI")
+    parser.add_argument('--db', default=db.DB_NAME, help="путь к базе")
+    parser.add_argument('--period', choices=PERIODS, default='all')
+    parser.add_argument('--from', dest='date_from', type=_parse_date, help="начало периода, YYYY-MM-DD")
+    parser.add_argument('--to', dest='date_to', type=_parse_date, help="конец периода включительно, YYYY-MM-DD")
+    parser.add_argument('--room', help="название рума")
+    parser.add_argument('--game-type', help="название типа игры")
+    parser.add_argument('--sections', nargs='+', choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument('--format', choices=tuple(RENDERERS), default='text')
+    parser.add_argument('-o', '--output', help="записать отчет в файл вместо stdout")
+    parser.add_argument('--timing', action='store_true',
+                        help="вывести в stderr время от старта и какие тяжелые модули загружены")
+    args = parser.parse_args(argv)
+
+    db.DB_NAME = args.db
+    db.init_db()
+    filters = build_filters(args)
+    report = build_report(filters, [s for s in SECTIONS if s in args.sections])
+    output = RENDERERS[args.format](report, filters)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output if output.endswith("\n") else output + "\n")
+
+    if args.timing:
+        heavy = [name for name in ('pandas', 'plotly', 'streamlit') if name in sys.modules]
+        print(f"report ready in {(time.perf_counter() - _started) * 1000:.0f} ms "
+              f"(heavy modules loaded: {', '.join(heavy) or 'none'})", file=sys.stderr)
+    db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,159 +1,1164 @@
+import os
 import sqlite3
-import pandas as pd
-from datetime import datetime
+import threading
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from profiling import profiled
+import logic
 
 DB_NAME = "poker_stats.db"
 
-def get_connection():
-    return sqlite3.connect(DB_NAME)
+# POKER_TRACKER_SNAPSHOT=1 — аналитика читает сессии из Parquet-снимка (snapshot.py),
+# SQLite остается источником истины для записи
+SNAPSHOT_READS = os.environ.get("POKER_TRACKER_SNAPSHOT") == "1"
 
-def init_db():
-    conn = get_connection()
-    c = conn.cursor()
-
-    # Таблица Rooms
-    c.execute('''CREATE TABLE IF NOT EXISTS rooms (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            deleted_at DATETIME
-        )''')
+# Пул долгоживущих соединений: открываются один раз и переиспользуются
+# между вызовами и потоками Streamlit (по одному потоку на соединение).
+POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+
+_pool_lock = threading.Lock()
+_pool = []
+_pool_db_name = None
+
+# Кэш читающих запросов. Ключ включает версию данных, которую увеличивает
+# каждая успешная запись, в том числе из другого процесса, поэтому устаревшие
+# результаты никогда не отдаются.
+# Закэшированные DataFrame общие для всех вызовов — их нельзя менять на месте.
+CACHE_SIZE = 32
+
+_cache_lock = threading.Lock()
+_cache = OrderedDict()
+_data_version = 0
+_data_listeners = []
+
+# Записи других процессов (watcher.py, importer.py, CLI) видны по PRAGMA data_version
+# отдельного соединения, которое само ничего не пишет: значение меняется после
+# каждого чужого коммита. [DB_NAME, соединение, последнее учтенное значение]
+_monitor_lock = threading.Lock()
+_monitor = None
+
+
+def _open_connection():
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def close_connections():
+    global _pool_db_name, _monitor
+    with _pool_lock:
+        while _pool:
+            _pool.pop().close()
+        _pool_db_name = None
+    with _monitor_lock:
+        if _monitor is not None:
+            _monitor[1].close()
+            _monitor = None
+
+
+@contextmanager
+def connection():
+    global _pool_db_name
+    conn = None
+    with _pool_lock:
+        # DB_NAME могли поменять (тесты, бенчмарки) — старые соединения не годятся
+        if _pool_db_name != DB_NAME:
+            while _pool:
+                _pool.pop().close()
+            _pool_db_name = DB_NAME
+        if _pool:
+            conn = _pool.pop()
+    if conn is None:
+        conn = _open_connection()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        with _pool_lock:
+            if _pool_db_name == DB_NAME and len(_pool) < POOL_SIZE:
+                _pool.append(conn)
+            else:
+                conn.close()
+
+
+@contextmanager
+def transaction(bump=True):
+    # bump=False — служебная запись (например, состояние импорта), которая
+    # не меняет данные, видимые читателям
+    with connection() as conn:
+        changes = conn.total_changes
+        conn.execute("BEGIN IMMEDIATE")
+        # Чужие коммиты до нашей блокировки учитываются сейчас, чтобы ниже
+        # не принять их за свой
+        _sync_data_version()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        changed = conn.total_changes != changes
+    if changed:
+        _external_version(accept=True)
+    # Закоммиченное изменение строк инвалидирует кэш чтения. DDL без изменения
+    # строк (init_db на каждом перезапуске скрипта) кэш не трогает.
+    if bump and changed:
+        _bump_data_version()
+
+
+def _external_version(accept=False):
+    # True, если с прошлой проверки базу менял кто-то другой.
+    # accept=True — принять текущее значение как учтенное (после своего коммита)
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None or _monitor[0] != DB_NAME:
+            if _monitor is not None:
+                _monitor[1].close()
+            _monitor = [DB_NAME, _open_connection(), None]
+        version = _monitor[1].execute("PRAGMA data_version").fetchone()[0]
+        changed = _monitor[2] is not None and version != _monitor[2] and not accept
+        _monitor[2] = version
+        return changed
+
+
+def _sync_data_version():
+    if _external_version():
+        _bump_data_version()
+
+
+def get_data_version():
+    _sync_data_version()
+    return _data_version
+
+
+def _bump_data_version():
+    global _data_version
+    # Справочники сбрасываются до новой версии: читатель, увидевший ее
+    # (например, фоновый пересчет дашборда), не возьмет старые id
+    invalidate_references()
+    with _cache_lock:
+        _data_version += 1
+        _cache.clear()
+        version = _data_version
+    for listener in list(_data_listeners):
+        listener(version)
+
+
+def add_data_listener(listener):
+    # listener(version) вызывается после каждой закоммиченной записи в потоке писателя,
+    # поэтому должен быть быстрым (например, ставить задание в очередь)
+    if listener not in _data_listeners:
+        _data_listeners.append(listener)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def _read_df(query, conn, **kwargs):
+    # pandas импортируется при первом чтении в DataFrame, а не при импорте модуля:
+    # CLI-отчеты обходятся без него и стартуют быстрее
+    import pandas as pd
+    return pd.read_sql_query(query, conn, **kwargs)
+
+
+def _cached(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        version = get_data_version()
+        key = (func.__name__, DB_NAME, version, args, tuple(sorted(kwargs.items())))
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key]
+        result = func(*args, **kwargs)
+        with _cache_lock:
+            # Если во время чтения прошла запись, результат мог устареть
+            if version == _data_version:
+                _cache[key] = result
+                while len(_cache) > CACHE_SIZE:
+                    _cache.popitem(last=False)
+        return result
+    return wrapper
+
+
+# --- Rollups ---
+# Итоги по дням и по месяцам в разрезе рум × тип игры. Поддерживаются
+# триггерами на sessions, поэтому дашборд читает сотни строк, а не всю историю.
+# Сессии без рума/типа попадают в группу с id 0.
+ROLLUP_TABLES = {
+    'rollup_daily': ('day', 10),
+    'rollup_monthly': ('month', 7),
+}
+
+
+def _rollup_add_sql(table, row):
+    period, length = ROLLUP_TABLES[table]
+    max_duration = ", max_duration" if table == 'rollup_daily' else ""
+    max_duration_value = f", IFNULL({row}.duration_minutes, 0)" if table == 'rollup_daily' else ""
+    max_duration_update = (", max_duration = MAX(max_duration, excluded.max_duration)"
+                           if table == 'rollup_daily' else "")
+    return f'''
+        INSERT INTO {table} ({period}, room_id, game_type_id, profit, buy_in, sessions, wins, minutes{max_duration})
+        VALUES (substr({row}.date, 1, {length}), IFNULL({row}.room_id, 0), IFNULL({row}.game_type_id, 0),
+                IFNULL({row}.profit, 0), IFNULL({row}.buy_in, 0), 1, IFNULL({row}.profit, 0) > 0,
+                IFNULL({row}.duration_minutes, 0){max_duration_value})
+        ON CONFLICT ({period}, room_id, game_type_id) DO UPDATE SET
+            profit = profit + excluded.profit,
+            buy_in = buy_in + excluded.buy_in,
+            sessions = sessions + 1,
+            wins = wins + excluded.wins,
+            minutes = minutes + excluded.minutes{max_duration_update};'''
+
+
+def _rollup_remove_sql(table, row):
+    period, length = ROLLUP_TABLES[table]
+    match = (f"{period} = substr({row}.date, 1, {length}) "
+             f"AND room_id = IFNULL({row}.room_id, 0) AND game_type_id = IFNULL({row}.game_type_id, 0)")
+    max_duration_update = ""
+    if table == 'rollup_daily':
+        # Максимум нельзя вычесть: пересчитываем по индексу (date, id), только если удалили максимум
+        max_duration_update = f''',
+            max_duration = CASE WHEN IFNULL({row}.duration_minutes, 0) < max_duration THEN max_duration
+                ELSE IFNULL((SELECT MAX(duration_minutes) FROM sessions
+                             WHERE date BETWEEN substr({row}.date, 1, 10) AND substr({row}.date, 1, 10) || '~'
+                               AND IFNULL(room_id, 0) = IFNULL({row}.room_id, 0)
+                               AND IFNULL(game_type_id, 0) = IFNULL({row}.game_type_id, 0)), 0)
+            END'''
+    return f'''
+        UPDATE {table} SET
+            profit = profit - IFNULL({row}.profit, 0),
+            buy_in = buy_in - IFNULL({row}.buy_in, 0),
+            sessions = sessions - 1,
+            wins = wins - (IFNULL({row}.profit, 0) > 0),
+            minutes = minutes - IFNULL({row}.duration_minutes, 0){max_duration_update}
+        WHERE {match};
+        DELETE FROM {table} WHERE {match} AND sessions <= 0;'''
+
+
+def _create_rollups(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS rollup_daily (
+            day TEXT NOT NULL,
+            room_id INTEGER NOT NULL,
+            game_type_id INTEGER NOT NULL,
+            profit REAL NOT NULL DEFAULT 0,
+            buy_in REAL NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            max_duration INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, room_id, game_type_id)
+        ) WITHOUT ROWID''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS rollup_monthly (
+            month TEXT NOT NULL,
+            room_id INTEGER NOT NULL,
+            game_type_id INTEGER NOT NULL,
+            profit REAL NOT NULL DEFAULT 0,
+            buy_in REAL NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, room_id, game_type_id)
+        ) WITHOUT ROWID''')
+
+    add_new = "".join(_rollup_add_sql(t, "NEW") for t in ROLLUP_TABLES)
+    remove_old = "".join(_rollup_remove_sql(t, "OLD") for t in ROLLUP_TABLES)
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sessions_rollup_insert
+        AFTER INSERT ON sessions BEGIN {add_new}
+        END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sessions_rollup_delete
+        AFTER DELETE ON sessions BEGIN {remove_old}
+        END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sessions_rollup_update
+        AFTER UPDATE OF date, room_id, game_type_id, buy_in, profit, duration_minutes ON sessions
+        BEGIN {remove_old}{add_new}
+        END''')
+
+
+def _rebuild_rollups(c):
+    c.execute("DELETE FROM rollup_daily")
+    c.execute('''INSERT INTO rollup_daily
+            (day, room_id, game_type_id, profit, buy_in, sessions, wins, max_duration, minutes)
+        SELECT substr(date, 1, 10), IFNULL(room_id, 0), IFNULL(game_type_id, 0),
+               SUM(IFNULL(profit, 0)), SUM(IFNULL(buy_in, 0)), COUNT(*),
+               SUM(IFNULL(profit, 0) > 0), MAX(IFNULL(duration_minutes, 0)),
+               SUM(IFNULL(duration_minutes, 0))
+        FROM sessions
+        GROUP BY 1, 2, 3''')
+    c.execute("DELETE FROM rollup_monthly")
+    c.execute('''INSERT INTO rollup_monthly
+            (month, room_id, game_type_id, profit, buy_in, sessions, wins, minutes)
+        SELECT substr(date, 1, 7), IFNULL(room_id, 0), IFNULL(game_type_id, 0),
+               SUM(IFNULL(profit, 0)), SUM(IFNULL(buy_in, 0)), COUNT(*),
+               SUM(IFNULL(profit, 0) > 0), SUM(IFNULL(duration_minutes, 0))
+        FROM sessions
+        GROUP BY 1, 2, 3''')
 
-    # Таблица Game Types
-    c.execute('''CREATE TABLE IF NOT EXISTS game_types (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            deleted_at DATETIME
-        )''')
 
-    # Таблица Sessions
-    c.execute('''CREATE TABLE IF NOT EXISTS sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT NOT NULL,
-            room_id INTEGER,
-            game_type_id INTEGER,
-            buy_in REAL,
-            cash_out REAL,
-            profit REAL,
-            duration_minutes INTEGER,
-            comments TEXT,
-            FOREIGN KEY (room_id) REFERENCES rooms (id),
-            FOREIGN KEY (game_type_id) REFERENCES game_types (id)
+@profiled
+def rebuild_rollups():
+    with transaction() as conn:
+        _rebuild_rollups(conn.cursor())
+
+
+# --- Change log ---
+# id сессий, измененных после последнего обновления снимка. Пересчет баланса
+# и правка комментариев не логируются: в снимке их нет. Журнал ведется только
+# в режиме снимка (CHANGE_LOG): без него таблицу никто не очищает.
+CHANGE_LOG = SNAPSHOT_READS
+
+LOG_TRIGGERS = ('trg_sessions_log_insert', 'trg_sessions_log_delete', 'trg_sessions_log_update')
+
+# session_id = 0 в журнале — пропуск в истории (журнал только что включили):
+# snapshot.refresh пересобирает снимок целиком
+LOG_RESTART = 0
+
+
+def _create_change_log(c, enabled=None):
+    enabled = CHANGE_LOG if enabled is None else enabled
+    c.execute('''CREATE TABLE IF NOT EXISTS session_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL
         )''')
+    existing = {row[0] for row in c.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_sessions_log_%'")}
+    if not enabled:
+        # Режим снимка выключен: триггеры снимаются, накопленный журнал очищается
+        for name in existing:
+            c.execute(f"DROP TRIGGER {name}")
+        if existing:
+            c.execute("DELETE FROM session_changes")
+        return
+    if existing == set(LOG_TRIGGERS):
+        return
+
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_sessions_log_insert
+        AFTER INSERT ON sessions BEGIN
+            INSERT INTO session_changes (session_id) VALUES (NEW.id);
+        END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_sessions_log_delete
+        AFTER DELETE ON sessions BEGIN
+            INSERT INTO session_changes (session_id) VALUES (OLD.id);
+        END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_sessions_log_update
+        AFTER UPDATE OF date, room_id, game_type_id, buy_in, cash_out, profit, duration_minutes ON sessions
+        BEGIN
+            INSERT INTO session_changes (session_id) VALUES (NEW.id);
+        END''')
+    # Пока журнал был выключен, изменения не записывались
+    c.execute("INSERT INTO session_changes (session_id) VALUES (?)", (LOG_RESTART,))
+
+
+# --- Running balance ---
+# sessions.balance — накопленная прибыль в порядке (date, id). Изменение
+# сессии пересчитывает только строки после нее.
+def _ensure_column(c, table, column, declaration):
+    columns = [row[1] for row in c.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return False
+    c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return True
+
+
+def _balance_before(conn, key):
+    row = conn.execute('''SELECT balance FROM sessions WHERE (date, id) < (?, ?)
+                          ORDER BY date DESC, id DESC LIMIT 1''', key).fetchone()
+    return row[0] if row and row[0] is not None else 0.0
+
+
+def _repair_balances(conn, from_key=None):
+    # Пересчет баланса от строки from_key = (date, id) и до конца истории
+    if from_key is None:
+        running, where, params = 0.0, "", []
+    else:
+        running = _balance_before(conn, from_key)
+        where, params = "WHERE (date, id) >= (?, ?)", list(from_key)
+    rows = conn.execute(f"SELECT id, IFNULL(profit, 0) FROM sessions {where} ORDER BY date, id", params)
+    updates = []
+    for session_id, profit in rows.fetchall():
+        running = round(running + profit, 2)
+        updates.append((running, session_id))
+    conn.executemany("UPDATE sessions SET balance = ? WHERE id = ?", updates)
+
+
+def _shift_balances(conn, key, delta):
+    conn.execute("UPDATE sessions SET balance = balance + ? WHERE (date, id) > (?, ?)",
+                 (delta, key[0], key[1]))
+
+
+@profiled
+def repair_balances(from_key=None, conn=None):
+    # from_key = (date, id): пересчитать только хвост истории начиная с этой позиции
+    if conn is not None:
+        _repair_balances(conn, from_key)
+        return
+    with transaction() as conn:
+        _repair_balances(conn, from_key)
+
+
+# --- Migrations ---
+# Версия схемы хранится в PRAGMA user_version. Миграция применяется один раз,
+# номер записывается после того, как она прошла целиком; прерванная миграция
+# при следующем запуске продолжается с места остановки.
+MIGRATION_BATCH_SIZE = 50_000
+
+# Дата строкой -> номер дня от 1970-01-01 (NULL для неразборчивой даты)
+EPOCH_DAY_SQL = "CAST(julianday(substr({0}, 1, 10)) - 2440587.5 AS INTEGER)"
+
+
+def _epoch_day(value):
+    return (value - date(1970, 1, 1)).days
+
+
+def days_to_dates(days):
+    # Номера дней -> datetime64 без разбора строк
+    return days.to_numpy(dtype='int64').astype('datetime64[D]').astype('datetime64[us]')
+
+
+def _migrate_epoch_day():
+    # 1: sessions.day — дата целым числом для фильтров и сортировки по индексу (day, id)
+    with transaction() as conn:
+        _ensure_column(conn, 'sessions', 'day', 'INTEGER')
+        # Триггеры раньше заполнения: строки, вставленные во время миграции, не потеряются
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sessions_day_insert
+            AFTER INSERT ON sessions WHEN NEW.day IS NULL BEGIN
+                UPDATE sessions SET day = {EPOCH_DAY_SQL.format('NEW.date')} WHERE id = NEW.id;
+            END''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_sessions_day_update
+            AFTER UPDATE OF date ON sessions BEGIN
+                UPDATE sessions SET day = {EPOCH_DAY_SQL.format('NEW.date')} WHERE id = NEW.id;
+            END''')
+
+    # Заполнение пачками по id: писатели не ждут одну длинную транзакцию
+    last_id = 0
+    while True:
+        with transaction() as conn:
+            batch = conn.execute("SELECT MAX(id) FROM (SELECT id FROM sessions WHERE id > ? AND day IS NULL "
+                                 "ORDER BY id LIMIT ?)", (last_id, MIGRATION_BATCH_SIZE)).fetchone()[0]
+            if batch is None:
+                break
+            conn.execute(f"UPDATE sessions SET day = {EPOCH_DAY_SQL.format('date')} "
+                         "WHERE id > ? AND id <= ? AND day IS NULL", (last_id, batch))
+        last_id = batch
+
+    # Индекс строится один раз по заполненной колонке
+    with transaction() as conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_day_id ON sessions (day, id)")
+
+
+def _migrate_balance():
+    # 2: sessions.balance — накопленная прибыль, для старой базы заполняется целиком
+    with transaction() as conn:
+        if _ensure_column(conn, 'sessions', 'balance', 'REAL'):
+            _repair_balances(conn)
+
+
+def _migrate_session_times():
+    # 3: необязательные время начала и конца сессии ('YYYY-MM-DD HH:MM:SS')
+    with transaction() as conn:
+        _ensure_column(conn, 'sessions', 'start_time', 'TEXT')
+        _ensure_column(conn, 'sessions', 'end_time', 'TEXT')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_timed ON sessions (date) WHERE start_time IS NOT NULL")
+
+
+def _migrate_rollup_minutes():
+    # 4: время за столами в роллапах. Старые триггеры его не знают:
+    # пересоздаются, роллапы пересчитываются
+    with transaction() as conn:
+        c = conn.cursor()
+        migrated = False
+        for table in ROLLUP_TABLES:
+            migrated |= _ensure_column(c, table, 'minutes', 'INTEGER NOT NULL DEFAULT 0')
+        if migrated:
+            for action in ('insert', 'delete', 'update'):
+                c.execute(f"DROP TRIGGER IF EXISTS trg_sessions_rollup_{action}")
+            _create_rollups(c)
+            _rebuild_rollups(c)
+
+
+# Базы, созданные до появления миграций 2-4, уже содержат их колонки:
+# миграции проверяют схему и ничего не меняют
+MIGRATIONS = (
+    (1, _migrate_epoch_day),
+    (2, _migrate_balance),
+    (3, _migrate_session_times),
+    (4, _migrate_rollup_minutes),
+)
+
+
+def _migrate():
+    with connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in MIGRATIONS:
+        if target > version:
+            migration()
+            with transaction() as conn:
+                conn.execute(f"PRAGMA user_version = {int(target)}")
+
+
+def schema_version():
+    with connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+@profiled
+def init_db():
+    with transaction() as conn:
+        c = conn.cursor()
 
-    # добавить начальные данные
+        # Таблица Rooms
+        c.execute('''CREATE TABLE IF NOT EXISTS rooms (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                deleted_at DATETIME
+            )''')
 
-    conn.commit()
-    conn.close()
+        # Таблица Game Types
+        c.execute('''CREATE TABLE IF NOT EXISTS game_types (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                deleted_at DATETIME
+            )''')
+
+        # Таблица Sessions
+        c.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                room_id INTEGER,
+                game_type_id INTEGER,
+                buy_in REAL,
+                cash_out REAL,
+                profit REAL,
+                duration_minutes INTEGER,
+                comments TEXT,
+                FOREIGN KEY (room_id) REFERENCES rooms (id),
+                FOREIGN KEY (game_type_id) REFERENCES game_types (id)
+            )''')
+
+        # Индексы под фильтры дашборда и сортировку журнала
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_date_id ON sessions (date, id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_room ON sessions (room_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_game_type ON sessions (game_type_id)")
+
+        # Роллапы: для существующей базы заполняются один раз при создании
+        has_rollups = c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_daily'").fetchone()
+        _create_rollups(c)
+        if not has_rollups:
+            _rebuild_rollups(c)
+
+        _create_change_log(c)
+
+        # добавить начальные данные
+
+    _migrate()
 
 
 # --- Functions for Rooms ---
+@profiled
 def add_room(name):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO rooms (name) VALUES (?)", (name,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT INTO rooms (name) VALUES (?)", (name,))
 
+@profiled
+@_cached
 def get_rooms():
-    conn = get_connection()
-    df = pd.read_sql_query("SELECT * FROM rooms WHERE deleted_at IS NULL ORDER BY id", conn)
-    conn.close()
-    return df
+    with connection() as conn:
+        return _read_df("SELECT * FROM rooms WHERE deleted_at IS NULL ORDER BY id", conn)
 
+@profiled
 def soft_delete_room(room_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE rooms SET deleted_at = ? WHERE id = ?", (datetime.now(), room_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("UPDATE rooms SET deleted_at = ? WHERE id = ?", (datetime.now(), room_id))
 
+@profiled
 def update_room(room_id, new_name):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE rooms SET name = ? WHERE id = ?", (new_name, room_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("UPDATE rooms SET name = ? WHERE id = ?", (new_name, room_id))
 
 # --- Functions for Game Types ---
+@profiled
 def add_game_type(name):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO game_types (name) VALUES (?)", (name,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT INTO game_types (name) VALUES (?)", (name,))
 
+@profiled
+@_cached
 def get_game_types():
-    conn = get_connection()
-    df = pd.read_sql_query("SELECT * FROM game_types WHERE deleted_at IS NULL ORDER BY id", conn)
-    conn.close()
-    return df
+    with connection() as conn:
+        return _read_df("SELECT * FROM game_types WHERE deleted_at IS NULL ORDER BY id", conn)
 
+@profiled
 def soft_delete_game_type(type_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE game_types SET deleted_at = ? WHERE id = ?", (datetime.now(), type_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("UPDATE game_types SET deleted_at = ? WHERE id = ?", (datetime.now(), type_id))
 
+@profiled
 def update_game_type(type_id, new_name):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("UPDATE game_types SET name = ? WHERE id = ?", (new_name, type_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("UPDATE game_types SET name = ? WHERE id = ?", (new_name, type_id))
+
+# --- Reference registry ---
+# Справочники меняются редко, а нужны на каждом перезапуске скрипта: карты
+# id <-> название живут в памяти процесса и сбрасываются вместе с версией
+# данных — любой закоммиченной записью, в том числе из другого процесса.
+@dataclass(frozen=True)
+class Reference:
+    active: tuple = ()                          # id неудаленных записей по порядку
+    names: dict = field(default_factory=dict)   # id -> название, включая удаленные
+    ids: dict = field(default_factory=dict)     # название -> id неудаленной записи
+
+    def name(self, ref_id, default=None):
+        return self.names.get(ref_id, default)
+
+    def id_of(self, name):
+        return self.ids.get(name)
+
+    def ids_named(self, name):
+        # Все id с таким названием, включая удаленные: у старых сессий свой id
+        return tuple(ref_id for ref_id, ref_name in self.names.items() if ref_name == name)
+
+
+_references_lock = threading.Lock()
+_references = {}
+_references_version = 0
+
+
+def invalidate_references():
+    global _references_version
+    with _references_lock:
+        _references_version += 1
+        _references.clear()
+
+
+def _reference(table):
+    key = (DB_NAME, table)
+    _sync_data_version()
+    with _references_lock:
+        version = _references_version
+        if key in _references:
+            return _references[key]
+    with connection() as conn:
+        rows = conn.execute(f"SELECT id, name, deleted_at FROM {table} ORDER BY id").fetchall()
+    active = [(ref_id, name) for ref_id, name, deleted_at in rows if deleted_at is None]
+    ids = {}
+    for ref_id, name in active:
+        ids.setdefault(name, ref_id)
+    reference = Reference(
+        active=tuple(ref_id for ref_id, _ in active),
+        names={ref_id: name for ref_id, name, _ in rows},
+        ids=ids,
+    )
+    with _references_lock:
+        # Справочник поменяли во время чтения — результат не кэшируется
+        if version == _references_version:
+            _references[key] = reference
+    return reference
+
+
+def room_registry():
+    return _reference('rooms')
+
+
+def game_type_registry():
+    return _reference('game_types')
 
 # --- Functions for Sessions ---
-def add_session(date, room_id, game_type_id, buy_in, cash_out, duration, comments = ''):
+@profiled
+def add_session(date, room_id, game_type_id, buy_in, cash_out, duration, comments = '',
+                start_time=None, end_time=None):
     profit = cash_out - buy_in
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute('''INSERT INTO sessions 
-                 (date, room_id, game_type_id, buy_in, cash_out, profit, duration_minutes, comments) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-              (date, room_id, game_type_id, buy_in, cash_out, profit, duration, comments))
-    conn.commit()
-    conn.close()
-
-def get_sessions_df():
-    conn = get_connection()
-    query = '''
+    with transaction() as conn:
+        session_id = conn.execute('''INSERT INTO sessions 
+                     (date, room_id, game_type_id, buy_in, cash_out, profit, duration_minutes, comments,
+                      start_time, end_time) 
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (date, room_id, game_type_id, buy_in, cash_out, profit, duration, comments,
+                   _timestamp(start_time), _timestamp(end_time))).lastrowid
+        key = conn.execute("SELECT date, id FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        conn.execute("UPDATE sessions SET balance = ? WHERE id = ?",
+                     (round(_balance_before(conn, key) + profit, 2), session_id))
+        _shift_balances(conn, key, profit)
+
+def _timestamp(value):
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+def _session_filters(start_date=None, end_date=None, room_id=None, game_type_id=None):
+    clauses = []
+    params = []
+    # Даты сравниваются по целому номеру дня (индекс (day, id)), а не строками
+    if start_date is not None:
+        clauses.append("s.day >= ?")
+        params.append(_epoch_day(start_date))
+    if end_date is not None:
+        clauses.append("s.day <= ?")
+        params.append(_epoch_day(end_date))
+    if room_id is not None:
+        clauses.append("s.room_id = ?")
+        params.append(int(room_id))
+    if game_type_id is not None:
+        clauses.append("s.game_type_id = ?")
+        params.append(int(game_type_id))
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, params
+
+# float32 хранит суммы точно до центов примерно до ±167 000 (2**24 центов)
+FLOAT32_MONEY_LIMIT = 2 ** 24 / 100
+
+
+def _compact_sessions(df):
+    # Категории вместо строк, узкие числовые типы где значения позволяют
+    for col in df.columns.intersection(['room', 'game_type']):
+        df[col] = df[col].astype('category')
+    for col in df.columns.intersection(['id', 'room_id', 'game_type_id']):
+        if df[col].notna().all():
+            df[col] = df[col].astype('int32')
+    for col in df.columns.intersection(['buy_in', 'cash_out', 'profit']):
+        if df[col].abs().max() < FLOAT32_MONEY_LIMIT:
+            df[col] = df[col].astype('float32')
+    if 'duration_minutes' in df.columns:
+        duration = df['duration_minutes']
+        if duration.notna().all() and duration.between(-32768, 32767).all():
+            df['duration_minutes'] = duration.astype('int16')
+    return df
+
+
+def memory_footprint(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+# Колонки get_sessions_df и их выражения в SQL (в порядке вывода)
+SESSION_COLUMNS = {
+    'id': "s.id",
+    'date': "s.day",
+    'room': "COALESCE(r.name, 'Unknown Room')",
+    'game_type': "COALESCE(g.name, 'Unknown Game')",
+    'buy_in': "s.buy_in",
+    'cash_out': "s.cash_out",
+    'profit': "s.profit",
+    'duration_minutes': "s.duration_minutes",
+    'comments': "s.comments",
+    'room_id': "s.room_id",
+    'game_type_id': "s.game_type_id",
+    # Время начала и конца (NaT — не указано): секунды от эпохи, без разбора строк в pandas
+    'start_time': "CAST(strftime('%s', s.start_time) AS INTEGER)",
+    'end_time': "CAST(strftime('%s', s.end_time) AS INTEGER)",
+}
+TIME_COLUMNS = ('start_time', 'end_time')
+
+
+def seconds_to_datetimes(seconds):
+    import pandas as pd
+    return pd.to_datetime(seconds, unit='s')
+
+
+@profiled
+@_cached
+def get_sessions_df(start_date=None, end_date=None, room_id=None, game_type_id=None,
+                    include_comments=False, compact=True, columns=None):
+    # Комментарии нужны только журналу, дашборд их не грузит.
+    # compact=False оставляет float64 — для редактирования сумм без потерь.
+    # columns — кортеж нужных колонок (None — все).
+    names = [name for name in SESSION_COLUMNS
+             if (columns is None or name in columns) and (name != 'comments' or include_comments)]
+
+    if SNAPSHOT_READS and not include_comments:
+        import snapshot
+        if snapshot.available():
+            df = snapshot.read_sessions(start_date, end_date, room_id, game_type_id, names)
+            return _compact_sessions(df) if compact else df
+
+    where, params = _session_filters(start_date, end_date, room_id, game_type_id)
+    select = ",\n        ".join(f"{SESSION_COLUMNS[name]} as {name}" for name in names)
+    # Названия присоединяются, только если их просили: дашборд работает с id
+    joins = "\n    ".join(join for name, join in (
+        ('room', "LEFT JOIN rooms r ON s.room_id = r.id"),
+        ('game_type', "LEFT JOIN game_types g ON s.game_type_id = g.id"),
+    ) if name in names)
+    query = f'''
+    SELECT 
+        {select}
+    FROM sessions s
+    {joins}
+    {where}
+    ORDER BY s.day DESC, s.id DESC
+    '''
+    with connection() as conn:
+        df = _read_df(query, conn, params=params)
+    if 'date' in names:
+        df['date'] = days_to_dates(df['date'])
+    for name in df.columns.intersection(TIME_COLUMNS):
+        df[name] = seconds_to_datetimes(df[name])
+    if compact:
+        df = _compact_sessions(df)
+    return df
+
+# --- Aggregates for the dashboard ---
+def _rollup_source(start_date=None, end_date=None, room_id=None, game_type_id=None, daily=False):
+    # Без фильтра по датам хватает месячных итогов, иначе нужны дневные
+    if daily or start_date is not None or end_date is not None:
+        table, period = 'rollup_daily', 'day'
+    else:
+        table, period = 'rollup_monthly', 'month'
+    clauses = []
+    params = []
+    if start_date is not None:
+        clauses.append("t.day >= ?")
+        params.append(start_date.strftime('%Y-%m-%d'))
+    if end_date is not None:
+        clauses.append("t.day <= ?")
+        params.append(end_date.strftime('%Y-%m-%d'))
+    if room_id is not None:
+        clauses.append("t.room_id = ?")
+        params.append(int(room_id))
+    if game_type_id is not None:
+        clauses.append("t.game_type_id = ?")
+        params.append(int(game_type_id))
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    return table, period, where, params
+
+@profiled
+@_cached
+def get_profit_by_month(start_date=None, end_date=None, room_id=None, game_type_id=None):
+    table, period, where, params = _rollup_source(start_date, end_date, room_id, game_type_id)
+    query = f'''
+    SELECT substr(t.{period}, 1, 7) as month_year, SUM(t.profit) as profit
+    FROM {table} t
+    {where}
+    GROUP BY month_year
+    ORDER BY month_year
+    '''
+    with connection() as conn:
+        return _read_df(query, conn, params=params)
+
+@profiled
+@_cached
+def get_profit_by_room(start_date=None, end_date=None, room_id=None, game_type_id=None):
+    table, _, where, params = _rollup_source(start_date, end_date, room_id, game_type_id)
+    query = f'''
+    SELECT COALESCE(r.name, 'Unknown Room') as room, SUM(t.profit) as profit
+    FROM {table} t
+    LEFT JOIN rooms r ON t.room_id = r.id
+    {where}
+    GROUP BY room
+    ORDER BY room
+    '''
+    with connection() as conn:
+        return _read_df(query, conn, params=params)
+
+@profiled
+@_cached
+def get_profit_by_game_type(start_date=None, end_date=None, room_id=None, game_type_id=None):
+    table, _, where, params = _rollup_source(start_date, end_date, room_id, game_type_id)
+    query = f'''
+    SELECT COALESCE(g.name, 'Unknown Game') as game_type, SUM(t.profit) as profit
+    FROM {table} t
+    LEFT JOIN game_types g ON t.game_type_id = g.id
+    {where}
+    GROUP BY game_type
+    ORDER BY game_type
+    '''
+    with connection() as conn:
+        return _read_df(query, conn, params=params)
+
+@profiled
+@_cached
+def get_kpi_totals(start_date=None, end_date=None, room_id=None, game_type_id=None):
+    # Те же KPI, что logic.calculate_kpi и get_roi, но из роллапов.
+    # Hourly Rate считается по реальному времени за компьютером (total_hours),
+    # seat_hours — сумма длительностей всех столов.
+    table, _, where, params = _rollup_source(start_date, end_date, room_id, game_type_id)
+    # ROI — по id типов с названием MTT, без соединения с game_types
+    mtt = ", ".join(str(type_id) for type_id in game_type_registry().ids_named('MTT')) or "NULL"
+    totals_query = f'''
+    SELECT
+        COALESCE(SUM(t.sessions), 0),
+        COALESCE(SUM(t.profit), 0),
+        COALESCE(SUM(t.wins), 0),
+        COALESCE(SUM(CASE WHEN t.game_type_id IN ({mtt}) THEN t.buy_in END), 0),
+        COALESCE(SUM(CASE WHEN t.game_type_id IN ({mtt}) THEN t.profit END), 0),
+        COALESCE(SUM(t.minutes), 0)
+    FROM {table} t
+    {where}
+    '''
+    daily_table, _, daily_where, daily_params = _rollup_source(
+        start_date, end_date, room_id, game_type_id, daily=True)
+    minutes_query = f'''
+    SELECT t.day, MAX(t.max_duration)
+    FROM {daily_table} t
+    {daily_where}
+    GROUP BY t.day
+    '''
+    with connection() as conn:
+        count, profit, wins, mtt_buy_in, mtt_profit, seat_minutes = conn.execute(totals_query, params).fetchone()
+        longest_by_day = conn.execute(minutes_query, daily_params).fetchall()
+
+    # За день: объединение интервалов сессий со временем, но не меньше самой длинной сессии
+    timed = get_timed_wall_minutes(room_id, game_type_id)
+    total_minutes = sum(max(longest, timed.get(day, 0)) for day, longest in longest_by_day)
+
+    total_hours = total_minutes / 60
+    return {
+        'total_profit': profit,
+        'total_sessions': count,
+        'wins': wins,
+        'win_rate': wins / count * 100 if count else 0.0,
+        'total_hours': total_hours,
+        'seat_hours': seat_minutes / 60,
+        'hourly_rate': profit / total_hours if total_hours > 0 else 0.0,
+        'roi': mtt_profit / mtt_buy_in * 100 if mtt_buy_in else 0.0,
+    }
+
+
+@profiled
+@_cached
+def get_timed_wall_minutes(room_id=None, game_type_id=None):
+    # {день: минуты} — объединенные интервалы сессий с указанным временем.
+    # Фильтр по датам сюда не входит: результат один на все периоды, а
+    # get_kpi_totals берет из него нужные дни.
+    where, params = _session_filters(room_id=room_id, game_type_id=game_type_id)
+    where += (" AND " if where else "WHERE ") + "s.start_time IS NOT NULL AND s.end_time IS NOT NULL"
+    query = f'''
+    SELECT substr(s.date, 1, 10), strftime('%s', s.start_time) / 60.0, strftime('%s', s.end_time) / 60.0
+    FROM sessions s
+    {where}
+    '''
+    with connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+    if not rows:
+        return {}
+    days, starts, ends = zip(*rows)
+    unique_days, wall = logic.wall_minutes_by_day(days, [0] * len(days), starts, ends)
+    return dict(zip((str(day) for day in unique_days), wall.tolist()))
+
+
+@profiled
+@_cached
+def get_cumulative_profit(start_date=None, end_date=None, room_id=None, game_type_id=None):
+    # Без фильтра по руму/типу кривая читается из сохраненного баланса по индексу
+    # (date, id) со сдвигом на баланс до начала периода. С фильтром баланс
+    # другой подвыборки — он считается оконной суммой.
+    where, params = _session_filters(start_date, end_date, room_id, game_type_id)
+    with connection() as conn:
+        if room_id is None and game_type_id is None:
+            base = 0.0
+            if start_date is not None:
+                base = _balance_before(conn, (start_date.strftime('%Y-%m-%d'), 0))
+            query = f'''
+            SELECT s.day as date, s.balance - ? as cumulative_profit
+            FROM sessions s
+            {where}
+            ORDER BY s.day, s.id
+            '''
+            params = [base] + params
+        else:
+            query = f'''
+            SELECT s.day as date, SUM(s.profit) OVER (ORDER BY s.day, s.id) as cumulative_profit
+            FROM sessions s
+            {where}
+            ORDER BY s.day, s.id
+            '''
+        df = _read_df(query, conn, params=params)
+    df['date'] = days_to_dates(df['date'])
+    return df
+
+
+# --- Plain rows for reports (без pandas) ---
+
+@profiled
+@_cached
+def get_monthly_totals(start_date=None, end_date=None, room_id=None, game_type_id=None):
+    table, period, where, params = _rollup_source(start_date, end_date, room_id, game_type_id)
+    query = f'''
+    SELECT substr(t.{period}, 1, 7) as month, SUM(t.sessions), SUM(t.wins), SUM(t.profit)
+    FROM {table} t
+    {where}
+    GROUP BY month
+    ORDER BY month
+    '''
+    with connection() as conn:
+        return tuple(
+            {'month': month, 'sessions': sessions, 'wins': wins, 'profit': round(profit, 2)}
+            for month, sessions, wins, profit in conn.execute(query, params)
+        )
+
+@profiled
+@_cached
+def get_profit_sequence(start_date=None, end_date=None, room_id=None, game_type_id=None):
+    # Номера дней от 1970-01-01 и профиты в хронологическом порядке — для стриков и просадки
+    where, params = _session_filters(start_date, end_date, room_id, game_type_id)
+    query = f'''
+    SELECT s.day, s.profit
+    FROM sessions s
+    {where}
+    ORDER BY s.day, s.id
+    '''
+    with connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+    return tuple(row[0] for row in rows), tuple(row[1] for row in rows)
+
+
+JOURNAL_PAGE_SIZES = (25, 50, 100, 250)
+
+
+@profiled
+def get_sessions_page(after_key=None, limit=50, filters=None):
+    # Keyset-пагинация по (day, id) в порядке журнала.
+    # after_key — ключ последней строки предыдущей страницы (None — первая страница).
+    # Возвращает (DataFrame, ключ для следующей страницы или None).
+    where, params = _session_filters(**(filters or {}))
+    if after_key is not None:
+        where += (" AND " if where else "WHERE ") + "(s.day, s.id) < (?, ?)"
+        params += [int(after_key[0]), int(after_key[1])]
+    query = f'''
     SELECT 
         s.id, 
-        s.date, 
+        s.day as date, 
         COALESCE(r.name, 'Unknown Room') as room, 
         COALESCE(g.name, 'Unknown Game') as game_type, 
         s.buy_in, 
         s.cash_out, 
         s.profit, 
         s.duration_minutes, 
-        s.comments,
-        s.room_id,
-        s.game_type_id
+        s.comments
     FROM sessions s
     LEFT JOIN rooms r ON s.room_id = r.id
     LEFT JOIN game_types g ON s.game_type_id = g.id
-    ORDER BY s.date DESC, s.id DESC
+    {where}
+    ORDER BY s.day DESC, s.id DESC
+    LIMIT ?
     '''
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    df['date'] = pd.to_datetime(df['date'])
-    return df
+    with connection() as conn:
+        # Берем на строку больше, чтобы знать, есть ли следующая страница
+        df = _read_df(query, conn, params=params + [int(limit) + 1])
+
+    next_key = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        next_key = (int(df['date'].iloc[-1]), int(df['id'].iloc[-1]))
+    return df.assign(date=days_to_dates(df['date'])), next_key
 
 def delete_session(session_id):
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    apply_session_changes(deletes=[session_id])
 
 def update_session(session_id, date, buy_in, cash_out, duration, comments):
-    profit = cash_out - buy_in
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute('''UPDATE sessions 
-                 SET date=?, buy_in=?, cash_out=?, profit=?, duration_minutes=?, comments=? 
-                 WHERE id=?''',
-              (date, buy_in, cash_out, profit, duration, comments, session_id))
-    conn.commit()
-    conn.close()
+    apply_session_changes(updates=[{
+        'id': session_id,
+        'date': date,
+        'buy_in': buy_in,
+        'cash_out': cash_out,
+        'duration_minutes': duration,
+        'comments': comments,
+    }])
+
+# Время начала после правки даты: тот же час, сдвинутый на разницу дней
+SHIFTED_START_SQL = ("datetime(start_time, (julianday(substr(:date, 1, 10)) "
+                     "- julianday(substr(date, 1, 10))) || ' days')")
+
+
+@profiled
+def apply_session_changes(deletes=(), updates=()):
+    # deletes — id сессий; updates — словари с ключами
+    # id, date, buy_in, cash_out, duration_minutes, comments.
+    # Всё применяется одной транзакцией: либо все строки, либо ни одной.
+    delete_params = [(int(session_id),) for session_id in deletes]
+    update_params = [dict(u, id=int(u['id'])) for u in updates]
+    if not delete_params and not update_params:
+        return
+    key_query = "SELECT date, id FROM sessions WHERE id = ?"
+    with transaction() as conn:
+        # Баланс пересчитывается один раз — от самой ранней затронутой позиции
+        touched = [conn.execute(key_query, p).fetchone() for p in delete_params]
+        touched += [conn.execute(key_query, (p['id'],)).fetchone() for p in update_params]
+        if delete_params:
+            conn.executemany("DELETE FROM sessions WHERE id = ?", delete_params)
+        if update_params:
+            # Время начала сдвигается вместе с датой, конец — начало плюс новая
+            # длительность (в SET все выражения видят старые значения строки)
+            conn.executemany(f'''UPDATE sessions 
+                     SET date=:date, buy_in=:buy_in, cash_out=:cash_out,
+                         profit=:cash_out - :buy_in,
+                         duration_minutes=:duration_minutes, comments=:comments,
+                         start_time={SHIFTED_START_SQL},
+                         end_time=datetime({SHIFTED_START_SQL}, :duration_minutes || ' minutes')
+                     WHERE id=:id''',
+                  update_params)
+            touched += [conn.execute(key_query, (p['id'],)).fetchone() for p in update_params]
+        touched = [key for key in touched if key is not None]
+        if touched:
+            _repair_balances(conn, min(touched))
+
+
+# --- Maintenance ---
+def object_sizes():
+    # [(имя таблицы или индекса, байт)] по убыванию. dbstat есть не в каждой сборке
+    # SQLite — тогда известен только общий размер файла.
+    with connection() as conn:
+        try:
+            return conn.execute(
+                "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC").fetchall()
+        except sqlite3.OperationalError:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            return [('(database)', page_size * page_count)]
+
+
+@profiled
+def maintain(vacuum=True):
+    # Статистика для планировщика, затем сжатие файла. VACUUM не работает внутри транзакции.
+    if not CHANGE_LOG:
+        # Остатки журнала изменений от прежнего режима снимка
+        with transaction(bump=False) as conn:
+            conn.execute("DELETE FROM session_changes")
+    with connection() as conn:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        if vacuum:
+            conn.execute("VACUUM")
+    return object_sizes()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Poker tracker database maintenance")
+    parser.add_argument('--db', default=DB_NAME, help="путь к базе")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild-rollups', help="пересчитать таблицы итогов по всем сессиям")
+    commands.add_parser('repair-balances', help="пересчитать накопленный баланс сессий")
+    maintain_parser = commands.add_parser('maintain', help="ANALYZE, PRAGMA optimize, VACUUM и размеры таблиц")
+    maintain_parser.add_argument('--no-vacuum', action='store_true', help="не перезаписывать файл базы")
+    args = parser.parse_args()
 
+    DB_NAME = args.db
+    init_db()
+    if args.command == 'rebuild-rollups':
+        rebuild_rollups()
+        print("Rollups rebuilt")
+    elif args.command == 'repair-balances':
+        repair_balances()
+        print("Balances repaired")
+    elif args.command == 'maintain':
+        before = os.path.getsize(DB_NAME)
+        sizes = maintain(vacuum=not args.no_vacuum)
+        print(f"Schema version {schema_version()}, file {before / 1024:,.0f} KB -> "
+              f"{os.path.getsize(DB_NAME) / 1024:,.0f} KB")
+        width = max(len(name) for name, _ in sizes)
+        for name, size in sizes:
+            print(f"{name:<{width}}  {size / 1024:>12,.0f} KB")
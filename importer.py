@@ -0,0 +1,160 @@
+import sys
+import time
+import pandas as pd
+import database as db
+
+CHUNK_SIZE = 20000
+
+# Заголовки из экспортов других трекеров -> наши колонки
+COLUMN_ALIASES = {
+    'day': 'date',
+    'session_date': 'date',
+    'start': 'date',
+    'site': 'room',
+    'room_name': 'room',
+    'game': 'game_type',
+    'type': 'game_type',
+    'buyin': 'buy_in',
+    'buy-in': 'buy_in',
+    'cashout': 'cash_out',
+    'cash-out': 'cash_out',
+    'duration': 'duration_minutes',
+    'minutes': 'duration_minutes',
+    'comment': 'comments',
+    'note': 'comments',
+    'notes': 'comments',
+}
+
+REQUIRED_COLUMNS = ['date', 'room', 'game_type', 'buy_in', 'cash_out']
+
+
+def _normalize_columns(chunk):
+    renamed = {}
+    for col in chunk.columns:
+        key = str(col).strip().lower()
+        renamed[col] = COLUMN_ALIASES.get(key, key)
+    chunk = chunk.rename(columns=renamed)
+    missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+    if missing:
+        raise ValueError(f"В файле нет колонок: {', '.join(missing)}")
+    return chunk
+
+
+def _load_name_map(conn, table):
+    rows = conn.execute(f"SELECT id, name FROM {table} WHERE deleted_at IS NULL ORDER BY id").fetchall()
+    return {name.strip().lower(): row_id for row_id, name in rows}
+
+
+def _resolve_ids(conn, table, names, name_map, created):
+    ids = []
+    for name in names:
+        key = name.strip().lower()
+        row_id = name_map.get(key)
+        if row_id is None:
+            row_id = conn.execute(f"INSERT INTO {table} (name) VALUES (?)", (name.strip(),)).lastrowid
+            name_map[key] = row_id
+            created.append(name.strip())
+        ids.append(row_id)
+    return ids
+
+
+def _session_key(date, room_id, game_type_id, buy_in, cash_out):
+    return (date, room_id, game_type_id, round(buy_in, 2), round(cash_out, 2))
+
+
+def import_sessions_csv(source, chunk_size=CHUNK_SIZE, progress=None):
+    # source — путь или файловый объект (в т.ч. st.file_uploader).
+    # Каждый чанк вставляется одной транзакцией через executemany.
+    started = time.perf_counter()
+    result = {
+        'rows': 0,
+        'inserted': 0,
+        'duplicates': 0,
+        'skipped': 0,
+        'rooms_created': [],
+        'game_types_created': [],
+    }
+
+    with db.connection() as conn:
+        room_map = _load_name_map(conn, 'rooms')
+        type_map = _load_name_map(conn, 'game_types')
+        existing = {
+            _session_key(str(d)[:10], r, g, b or 0.0, c or 0.0)
+            for d, r, g, b, c in conn.execute(
+                "SELECT date, room_id, game_type_id, buy_in, cash_out FROM sessions")
+        }
+
+    _import_chunks(source, chunk_size, progress, result, room_map, type_map, existing)
+
+    result['seconds'] = time.perf_counter() - started
+    result['rows_per_sec'] = result['rows'] / result['seconds'] if result['seconds'] > 0 else 0.0
+    return result
+
+
+def _import_chunks(source, chunk_size, progress, result, room_map, type_map, existing):
+    for chunk in pd.read_csv(source, chunksize=chunk_size, skipinitialspace=True):
+        chunk = _normalize_columns(chunk)
+        result['rows'] += len(chunk)
+
+        dates = pd.to_datetime(chunk['date'], errors='coerce', format='mixed')
+        buy_in = pd.to_numeric(chunk['buy_in'], errors='coerce')
+        cash_out = pd.to_numeric(chunk['cash_out'], errors='coerce')
+        valid = (dates.notna() & buy_in.notna() & cash_out.notna()
+                 & chunk['room'].notna() & chunk['game_type'].notna())
+        result['skipped'] += int((~valid).sum())
+        if not valid.any():
+            continue
+
+        chunk = chunk[valid]
+        # Номер дня пишется сразу, чтобы триггер не обновлял каждую вставленную строку
+        days = dates[valid].to_numpy().astype('datetime64[D]').astype('int64')
+        dates = dates[valid].dt.strftime('%Y-%m-%d')
+        buy_in = buy_in[valid].astype(float)
+        cash_out = cash_out[valid].astype(float)
+        if 'duration_minutes' in chunk.columns:
+            duration = pd.to_numeric(chunk['duration_minutes'], errors='coerce').fillna(0).astype(int)
+        else:
+            duration = pd.Series(0, index=chunk.index)
+        if 'comments' in chunk.columns:
+            comments = chunk['comments'].fillna('').astype(str)
+        else:
+            comments = pd.Series('', index=chunk.index)
+
+        with db.transaction() as conn:
+            room_ids = _resolve_ids(conn, 'rooms', chunk['room'].astype(str),
+                                    room_map, result['rooms_created'])
+            type_ids = _resolve_ids(conn, 'game_types', chunk['game_type'].astype(str),
+                                    type_map, result['game_types_created'])
+
+            rows = []
+            for d, day, r, g, b, c, dur, com in zip(dates, days, room_ids, type_ids, buy_in, cash_out,
+                                                     duration, comments):
+                key = _session_key(d, r, g, b, c)
+                if key in existing:
+                    result['duplicates'] += 1
+                    continue
+                existing.add(key)
+                rows.append((d, int(day), r, g, b, c, c - b, int(dur), com))
+
+            conn.executemany('''INSERT INTO sessions
+                     (date, day, room_id, game_type_id, buy_in, cash_out, profit, duration_minutes, comments)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+            # Баланс — в той же транзакции, от самой ранней даты чанка: читатели
+            # не видят строк без баланса, даже если импорт прервется
+            if rows:
+                db.repair_balances((min(row[0] for row in rows), 0), conn=conn)
+        result['inserted'] += len(rows)
+
+        if progress is not None:
+            progress(result['rows'])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python importer.py sessions.csv")
+        sys.exit(1)
+    db.init_db()
+    stats = import_sessions_csv(sys.argv[1], progress=lambda n: print(f"... {n} rows"))
+    print(f"Inserted {stats['inserted']} of {stats['rows']} rows "
+          f"({stats['duplicates']} duplicates, {stats['skipped']} skipped) "
+          f"in {stats['seconds']:.2f}s, {stats['rows_per_sec']:.0f} rows/sec")
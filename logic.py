@@ -1,5 +1,73 @@
-import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+from profiling import profiled
 
+
+@dataclass
+class Streak:
+    # sign: 1 — серия выигрышей, -1 — проигрышей, 0 — нет серии
+    sign: int = 0
+    length: int = 0
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+
+
+@dataclass
+class StreakSummary:
+    longest_win: Streak = field(default_factory=Streak)
+    longest_loss: Streak = field(default_factory=Streak)
+    current: Streak = field(default_factory=Streak)
+
+
+@dataclass
+class DrawdownSummary:
+    max_drawdown: float = 0.0
+    # Индексы в хронологическом массиве; peak_index == -1 — стартовый ноль
+    peak_index: int = -1
+    trough_index: int = -1
+    peak_date: Optional[str] = None
+    trough_date: Optional[str] = None
+    longest_underwater_sessions: int = 0
+    longest_underwater_days: int = 0
+    current_drawdown: float = 0.0
+
+
+@dataclass
+class DashboardStats:
+    total_profit: float = 0.0
+    hourly_rate: float = 0.0
+    total_sessions: int = 0
+    win_rate: float = 0.0
+    best_win: Optional[Tuple[float, str]] = None
+    worst_loss: Optional[Tuple[float, str]] = None
+    streaks: StreakSummary = field(default_factory=StreakSummary)
+    drawdown: DrawdownSummary = field(default_factory=DrawdownSummary)
+    roi: float = 0.0
+    # Отсортированные по (date, id) даты и накопленная прибыль для графика
+    dates: np.ndarray = field(default_factory=lambda: np.array([], dtype='datetime64[ns]'))
+    cumulative_profit: np.ndarray = field(default_factory=lambda: np.array([], dtype=np.float64))
+
+
+@dataclass
+class SimulationResult:
+    paths: int = 0
+    horizon: int = 0
+    percentiles: Tuple[int, ...] = ()
+    # Номера сессий, в которых сняты полосы, и квантили накопленной прибыли:
+    # bands[i] соответствует percentiles[i]
+    steps: np.ndarray = field(default_factory=lambda: np.array([], dtype=np.int64))
+    bands: np.ndarray = field(default_factory=lambda: np.empty((0, 0)))
+    final_profit: Dict[int, float] = field(default_factory=dict)
+    hourly_rate: Dict[int, float] = field(default_factory=dict)
+    roi: Dict[int, float] = field(default_factory=dict)
+    # Размер просадки -> вероятность хотя бы раз ее пережить за горизонт
+    downswings: Dict[float, float] = field(default_factory=dict)
+    risk_of_ruin: Optional[float] = None
+
+
+@profiled
 def calculate_kpi(df):
     if df.empty:
         return 0, 0, 0, 0
@@ -17,6 +85,7 @@ def calculate_kpi(df):
     return total_profit, hourly_rate, total_sessions, win_rate
 
 
+@profiled
 def get_records(df):
     if df.empty:
         return {}
@@ -29,34 +98,17 @@ def get_records(df):
         'worst_loss': (worst_loss_row['profit'], worst_loss_row['date'].strftime('%Y-%m-%d')),
     }
 
+@profiled
 def calculate_streaks(df):
     if df.empty:
         return 0, 0
 
     df_sorted = df.sort_values(by='date')
-    profits = df_sorted['profit'].tolist()
-
-    max_win_streak = 0
-    max_loss_streak = 0
-    current_win = 0
-    current_loss = 0
-
-    for p in profits:
-        if p > 0:
-            current_win += 1
-            current_loss = 0
-            max_win_streak = max(max_win_streak, current_win)
-        elif p < 0:
-            current_loss += 1
-            current_win = 0
-            max_loss_streak = max(max_loss_streak, current_loss)
-        else:
-            current_win = 0
-            current_loss = 0
-
-    return max_win_streak, max_loss_streak
+    summary = streak_summary(df_sorted['profit'].to_numpy(dtype=np.float64))
+    return summary.longest_win.length, summary.longest_loss.length
 
 
+@profiled
 def get_roi(df):
     mtt_df = df[df['game_type'] == 'MTT']
 
@@ -72,20 +124,394 @@ def get_roi(df):
     return (total_profit / total_buyin) * 100
 
 
+@profiled
 def calc_hourly_rate(df, total_profit):
     if df.empty:
         return 0
-    df_calc = df.copy()
-    if not df_calc['date'].empty and hasattr(df_calc['date'].dt, 'date'):
-        df_calc['date_group'] = df_calc['date'].dt.date
-    else:
-        df_calc['date_group'] = df_calc['date']
 
-    daily_durations = df_calc.groupby('date_group')['duration_minutes'].max()
-    total_real_minutes = daily_durations.sum()
-    total_real_hours = total_real_minutes / 60
+    starts, ends = session_times(df)
+    _, wall_minutes = wall_minutes_by_day(np.asarray(df['date'], dtype='datetime64[D]'),
+                                          df['duration_minutes'].to_numpy(dtype=np.float64),
+                                          starts, ends)
+    total_real_hours = wall_minutes.sum() / 60
 
     hourly_rate = total_profit / total_real_hours if total_real_hours > 0 else 0
 
     return hourly_rate
 
+
+def session_times(df):
+    # start_time / end_time в минутах от эпохи; NaN — время сессии не указано
+    if 'start_time' not in df.columns or 'end_time' not in df.columns:
+        return None, None
+    return _epoch_minutes(df['start_time']), _epoch_minutes(df['end_time'])
+
+
+def _epoch_minutes(values):
+    values = np.asarray(values, dtype='datetime64[m]')
+    minutes = values.astype(np.int64).astype(np.float64)
+    minutes[np.isnat(values)] = np.nan
+    return minutes
+
+
+@profiled
+def merge_intervals(starts, ends):
+    # Объединение интервалов: сортировка по началу и один проход — интервал
+    # начинает новый блок, только если стартует позже самого дальнего конца до него.
+    # Возвращает начала и концы блоков и индекс первого интервала каждого блока.
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    if len(starts) == 0:
+        return starts, ends, np.array([], dtype=np.int64)
+
+    order = np.lexsort((ends, starts))
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    heads = np.flatnonzero(np.r_[True, starts[1:] > reach[:-1]])
+    return starts[heads], np.maximum.reduceat(ends, heads), order[heads]
+
+
+@profiled
+def wall_minutes_by_day(days, durations, starts=None, ends=None):
+    # Реальное время за компьютером по дням (мультитейблинг считается один раз).
+    # Сессии со временем начала/конца объединяются как интервалы; блок относится
+    # к дню своей первой сессии. Для сессий без времени, как и раньше, берется
+    # самая длинная за день — считается, что они шли параллельно.
+    days = np.asarray(days, dtype='datetime64[D]')
+    durations = np.nan_to_num(np.asarray(durations, dtype=np.float64))
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    wall = np.zeros(len(unique_days))
+
+    timed = np.zeros(len(days), dtype=bool)
+    if starts is not None and ends is not None:
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        timed = ~np.isnan(starts) & ~np.isnan(ends)
+
+    np.maximum.at(wall, day_index[~timed], durations[~timed])
+    if timed.any():
+        block_starts, block_ends, first = merge_intervals(starts[timed], ends[timed])
+        block_days = day_index[timed][first]
+        wall = np.maximum(wall, np.bincount(block_days, weights=block_ends - block_starts,
+                                            minlength=len(unique_days)))
+    return unique_days, wall
+
+
+def _money(series):
+    # Суммы могут прийти во float32 — возвращаем точные центы во float64
+    return np.round(series.to_numpy(dtype=np.float64), 2)
+
+
+def _chronological_order(df):
+    dates = df['date'].to_numpy()
+    if 'id' in df.columns:
+        return np.lexsort((df['id'].to_numpy(), dates))
+    return np.argsort(dates, kind='stable')
+
+
+def _runs(values):
+    # Run-length encoding: начало, длина и значение каждой серии
+    n = len(values)
+    starts = np.flatnonzero(np.r_[True, np.diff(values) != 0])
+    lengths = np.diff(np.r_[starts, n])
+    return starts, lengths, values[starts]
+
+
+def _day_str(dates, i):
+    if dates is None or i < 0:
+        return None
+    return str(dates[i].astype('datetime64[D]'))
+
+
+@profiled
+def streak_summary(profits, dates=None):
+    # profits и dates должны быть в хронологическом порядке
+    profits = np.asarray(profits, dtype=np.float64)
+    if len(profits) == 0:
+        return StreakSummary()
+
+    signs = np.where(profits > 0, 1, np.where(profits < 0, -1, 0)).astype(np.int8)
+    starts, lengths, run_signs = _runs(signs)
+
+    def make(k):
+        first = int(starts[k])
+        last = first + int(lengths[k]) - 1
+        return Streak(int(run_signs[k]), int(lengths[k]), _day_str(dates, first), _day_str(dates, last))
+
+    def longest(sign):
+        candidates = np.flatnonzero(run_signs == sign)
+        if len(candidates) == 0:
+            return Streak()
+        return make(candidates[np.argmax(lengths[candidates])])
+
+    current = make(len(starts) - 1) if run_signs[-1] != 0 else Streak()
+    return StreakSummary(longest(1), longest(-1), current)
+
+
+@profiled
+def drawdown_summary(cumulative, dates=None):
+    # cumulative — накопленная прибыль в хронологическом порядке
+    cumulative = np.asarray(cumulative, dtype=np.float64)
+    n = len(cumulative)
+    if n == 0:
+        return DrawdownSummary()
+
+    # Стартовый банкролл (0) считается первым пиком
+    peaks = np.maximum(np.maximum.accumulate(cumulative), 0.0)
+    drawdowns = peaks - cumulative
+
+    positions = np.arange(n)
+    peak_positions = np.maximum.accumulate(np.where(cumulative >= peaks, positions, -1))
+
+    trough = int(np.argmax(drawdowns))
+    max_drawdown = float(drawdowns[trough])
+    peak = int(peak_positions[trough])
+
+    underwater_sessions = 0
+    underwater_days = 0
+    starts, lengths, values = _runs(drawdowns > 0)
+    wet = np.flatnonzero(values)
+    if len(wet):
+        k = wet[np.argmax(lengths[wet])]
+        underwater_sessions = int(lengths[k])
+        if dates is not None:
+            first = int(starts[k])
+            # От последнего пика (или первой сессии) до восстановления или последней сессии
+            begin = dates[first - 1] if first > 0 else dates[first]
+            end_index = min(first + underwater_sessions, n - 1)
+            underwater_days = int((dates[end_index] - begin) / np.timedelta64(1, 'D'))
+
+    return DrawdownSummary(
+        max_drawdown=max_drawdown,
+        peak_index=peak if max_drawdown > 0 else -1,
+        trough_index=trough if max_drawdown > 0 else -1,
+        peak_date=_day_str(dates, peak) if max_drawdown > 0 else None,
+        trough_date=_day_str(dates, trough) if max_drawdown > 0 else None,
+        longest_underwater_sessions=underwater_sessions,
+        longest_underwater_days=underwater_days,
+        current_drawdown=float(drawdowns[-1]),
+    )
+
+
+# Колонки, которые читают compute_dashboard_stats и simulate_sessions: тип игры — id,
+# названия подставляются из database.game_type_registry только для подписей;
+# start_time/end_time — для реального времени за компьютером
+DASHBOARD_COLUMNS = ('id', 'date', 'game_type_id', 'buy_in', 'profit', 'duration_minutes', 'start_time', 'end_time')
+
+
+def _mtt_mask(df, mtt_type_ids=None):
+    # По id типов — сравнение целых чисел; без id — по названию (полный DataFrame)
+    if mtt_type_ids is not None:
+        return np.isin(df['game_type_id'].to_numpy(), np.asarray(mtt_type_ids, dtype=np.float64))
+    if 'game_type' not in df.columns:
+        raise ValueError("Без колонки game_type нужен mtt_type_ids "
+                         "(например, database.game_type_registry().ids_named('MTT'))")
+    return df['game_type'].to_numpy() == 'MTT'
+
+
+@profiled
+def compute_dashboard_stats(df, mtt_type_ids=None):
+    # Одна сортировка и общие NumPy-массивы для всех метрик дашборда
+    if df.empty:
+        return DashboardStats()
+
+    order = _chronological_order(df)
+    dates = df['date'].to_numpy()[order]
+    profit = _money(df['profit'])[order]
+    buy_in = _money(df['buy_in'])[order]
+    duration = df['duration_minutes'].to_numpy(dtype=np.float64)[order]
+    starts, ends = session_times(df)
+    is_mtt = _mtt_mask(df, mtt_type_ids)[order]
+
+    total_sessions = len(profit)
+    total_profit = float(profit.sum())
+    win_rate = float(np.count_nonzero(profit > 0)) / total_sessions * 100
+
+    # Hourly Rate: по реальному времени за компьютером, а не по сумме столов
+    days = dates.astype('datetime64[D]')
+    if starts is not None:
+        starts, ends = starts[order], ends[order]
+    _, wall_minutes = wall_minutes_by_day(days, duration, starts, ends)
+    total_real_hours = wall_minutes.sum() / 60
+    hourly_rate = total_profit / total_real_hours if total_real_hours > 0 else 0
+
+    best = int(np.argmax(profit))
+    worst = int(np.argmin(profit))
+
+    cumulative = np.cumsum(profit)
+
+    mtt_buyin = buy_in[is_mtt].sum()
+    roi = float(profit[is_mtt].sum() / mtt_buyin * 100) if mtt_buyin != 0 else 0.0
+
+    return DashboardStats(
+        total_profit=total_profit,
+        hourly_rate=hourly_rate,
+        total_sessions=total_sessions,
+        win_rate=win_rate,
+        best_win=(float(profit[best]), str(days[best])),
+        worst_loss=(float(profit[worst]), str(days[worst])),
+        streaks=streak_summary(profit, dates),
+        drawdown=drawdown_summary(cumulative, dates),
+        roi=roi,
+        dates=dates,
+        cumulative_profit=cumulative,
+    )
+
+
+# Кривые длиннее этого порога прореживаются перед отправкой в браузер
+DOWNSAMPLE_THRESHOLD = 2000
+DOWNSAMPLE_POINTS = 1000
+
+
+@profiled
+def downsample_lttb(x, y, target_points=DOWNSAMPLE_POINTS):
+    # Largest-Triangle-Three-Buckets: из каждой корзины берется точка, образующая
+    # наибольший треугольник с предыдущей выбранной точкой и средним следующей корзины.
+    # Глобальные максимум/минимум и пик/дно максимальной просадки сохраняются всегда.
+    # Возвращает отсортированные индексы выбранных точек.
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if target_points >= n or target_points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[ns]').astype(np.int64)
+    x = x.astype(np.float64)
+
+    bucket_edges = np.linspace(1, n - 1, target_points - 1).astype(np.int64)
+    selected = np.empty(target_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(target_points - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        next_start = end
+        next_end = bucket_edges[i + 2] if i + 2 < len(bucket_edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bx = x[start:end]
+        by = y[start:end]
+        areas = np.abs((x[previous] - avg_x) * (by - y[previous])
+                       - (x[previous] - bx) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    drawdown = drawdown_summary(y)
+    keep = [int(np.argmax(y)), int(np.argmin(y)), drawdown.peak_index, drawdown.trough_index]
+    keep = [i for i in keep if i >= 0]
+    return np.unique(np.concatenate([selected, keep]))
+
+
+# Симуляция дисперсии: будущие сессии сэмплируются из истории с возвращением,
+# с сохранением доли каждого типа игры. Пути считаются матрицами по чанкам,
+# чтобы память не зависела от числа путей.
+SIMULATION_PATHS = 100_000
+SIMULATION_HORIZON = 500
+SIMULATION_PERCENTILES = (5, 25, 50, 75, 95)
+# Ячеек (путей × сессий) в одном чанке: ~16 МБ на матрицу float64
+SIMULATION_CHUNK_CELLS = 2_000_000
+SIMULATION_BAND_POINTS = 100
+
+
+def _simulate_chunk(task):
+    # Выполняется и в процессе-воркере, поэтому все данные приходят аргументом
+    (seed, n_paths, horizon, pools, shares, profit, buy_in, duration, is_mtt,
+     checkpoints) = task
+    rng = np.random.default_rng(seed)
+
+    if len(pools) == 1:
+        idx = pools[0][rng.integers(0, len(pools[0]), size=(n_paths, horizon))]
+    else:
+        types = np.searchsorted(np.cumsum(shares)[:-1], rng.random((n_paths, horizon)), side='right')
+        idx = np.empty((n_paths, horizon), dtype=np.int64)
+        for k, pool in enumerate(pools):
+            mask = types == k
+            idx[mask] = pool[rng.integers(0, len(pool), size=int(mask.sum()))]
+
+    path_profit = profit[idx]
+    cumulative = np.cumsum(path_profit, axis=1)
+    peaks = np.maximum(np.maximum.accumulate(cumulative, axis=1), 0.0)
+    mtt = is_mtt[idx]
+    return {
+        'final': cumulative[:, -1],
+        'minutes': duration[idx].sum(axis=1),
+        'mtt_profit': np.where(mtt, path_profit, 0.0).sum(axis=1),
+        'mtt_buy_in': np.where(mtt, buy_in[idx], 0.0).sum(axis=1),
+        'max_drawdown': (peaks - cumulative).max(axis=1),
+        'lowest': np.minimum(cumulative.min(axis=1), 0.0),
+        'checkpoints': cumulative[:, checkpoints].astype(np.float32),
+    }
+
+
+def _percentile_map(values, percentiles):
+    if len(values) == 0:
+        return {}
+    return dict(zip(percentiles, np.percentile(values, percentiles).tolist()))
+
+
+@profiled
+def simulate_sessions(df, horizon=SIMULATION_HORIZON, paths=SIMULATION_PATHS, bankroll=None,
+                      downswings=(), mix=None, percentiles=SIMULATION_PERCENTILES, seed=None, workers=1,
+                      chunk_cells=SIMULATION_CHUNK_CELLS, mtt_type_ids=None):
+    # Bootstrap по сессиям отфильтрованной истории на horizon сессий вперед.
+    # mix — будущая доля типов игр ({game_type_id: 0.5, ...}); внутри типа сессии
+    # берутся из его истории. None — доли как в истории, т.е. обычный bootstrap.
+    # workers > 1 — чанки считаются в пуле процессов; результат от числа воркеров
+    # не зависит, потому что у каждого чанка свой seed.
+    if df.empty or horizon < 1 or paths < 1:
+        return SimulationResult()
+
+    profit = _money(df['profit'])
+    buy_in = _money(df['buy_in'])
+    duration = np.nan_to_num(df['duration_minutes'].to_numpy(dtype=np.float64))
+    is_mtt = _mtt_mask(df, mtt_type_ids)
+
+    pools, shares = [np.arange(len(profit))], np.ones(1)
+    if mix:
+        game_types = df['game_type_id'].to_numpy()
+        pools = [np.flatnonzero(game_types == type_id) for type_id in mix]
+        shares = np.array([share if len(pool) else 0.0 for pool, share in zip(pools, mix.values())])
+        if shares.sum() <= 0:
+            return SimulationResult()
+        pools = [pool for pool, share in zip(pools, shares) if share > 0]
+        shares = shares[shares > 0] / shares.sum()
+
+    # Часы пути считаются по длительностям столов; коэффициент переводит их во
+    # время за компьютером так же, как для реального Hourly Rate
+    starts, ends = session_times(df)
+    _, wall_minutes = wall_minutes_by_day(np.asarray(df['date'], dtype='datetime64[D]'), duration, starts, ends)
+    wall_ratio = wall_minutes.sum() / duration.sum() if duration.sum() > 0 else 1.0
+
+    checkpoints = np.unique(np.linspace(0, horizon - 1, min(horizon, SIMULATION_BAND_POINTS)).astype(np.int64))
+    chunk_paths = max(1, chunk_cells // horizon)
+    sizes = [min(chunk_paths, paths - start) for start in range(0, paths, chunk_paths)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(s, n, horizon, pools, shares, profit, buy_in, duration, is_mtt, checkpoints)
+             for s, n in zip(seeds, sizes)]
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(_simulate_chunk, tasks))
+    else:
+        chunks = [_simulate_chunk(task) for task in tasks]
+
+    results = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+    hours = results['minutes'] * wall_ratio / 60
+    played = hours > 0
+    has_mtt = results['mtt_buy_in'] > 0
+
+    return SimulationResult(
+        paths=paths,
+        horizon=horizon,
+        percentiles=tuple(percentiles),
+        steps=checkpoints + 1,
+        bands=np.percentile(results['checkpoints'], percentiles, axis=0),
+        final_profit=_percentile_map(results['final'], percentiles),
+        hourly_rate=_percentile_map(results['final'][played] / hours[played], percentiles),
+        roi=_percentile_map(results['mtt_profit'][has_mtt] / results['mtt_buy_in'][has_mtt] * 100,
+                            percentiles),
+        downswings={float(size): float(np.mean(results['max_drawdown'] >= size)) for size in downswings},
+        risk_of_ruin=float(np.mean(results['lowest'] <= -bankroll)) if bankroll else None,
+    )
@@ -0,0 +1,123 @@
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Легкий реестр таймингов: число вызовов, время и число строк по каждой
+# функции/блоку за последний прогон скрипта плюс скользящая история для перцентилей.
+# Прогоны разных сессий браузера хранятся отдельно; вызовы вне прогона (фоновые
+# потоки watcher/worker, у которых свой контекст) не записываются.
+HISTORY_SIZE = 500
+MAX_RUNS = 64
+
+_lock = threading.Lock()
+_runs = OrderedDict()
+_history = defaultdict(lambda: deque(maxlen=HISTORY_SIZE))
+_current = ContextVar('profiling_run', default=None)
+
+
+def start_run(key='default'):
+    # Новый прогон для key (например, id сессии Streamlit) в текущем контексте
+    _current.set(key)
+    with _lock:
+        _runs[key] = {'items': {}, 'started': time.perf_counter()}
+        _runs.move_to_end(key)
+        while len(_runs) > MAX_RUNS:
+            _runs.popitem(last=False)
+
+
+def _rows(result):
+    if isinstance(result, tuple) and result and hasattr(result[0], 'shape'):
+        result = result[0]
+    if hasattr(result, 'shape') and len(result.shape) > 0:
+        return int(result.shape[0])
+    return None
+
+
+def record(name, elapsed_ms, rows=None):
+    key = _current.get()
+    if key is None:
+        return
+    with _lock:
+        run = _runs.get(key)
+        if run is None:
+            return
+        entry = run['items'].setdefault(name, {'calls': 0, 'total_ms': 0.0, 'rows': 0})
+        entry['calls'] += 1
+        entry['total_ms'] += elapsed_ms
+        if rows is not None:
+            entry['rows'] += rows
+        _history[name].append(elapsed_ms)
+
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - started) * 1000)
+
+
+def profiled(func):
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        record(name, (time.perf_counter() - started) * 1000, _rows(result))
+        return result
+    return wrapper
+
+
+def _percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def last_run(key=None):
+    key = key if key is not None else _current.get()
+    with _lock:
+        run = _runs.get(key, {'items': {}, 'started': None})
+        items = [dict(name=name, **entry) for name, entry in run['items'].items()]
+        wall_ms = (time.perf_counter() - run['started']) * 1000 if run['started'] is not None else None
+    items.sort(key=lambda item: item['total_ms'], reverse=True)
+    for item in items:
+        item['total_ms'] = round(item['total_ms'], 3)
+    return items, wall_ms
+
+
+def rolling_stats():
+    with _lock:
+        history = {name: sorted(values) for name, values in _history.items() if values}
+    stats = []
+    for name, values in history.items():
+        stats.append({
+            'name': name,
+            'samples': len(values),
+            'p50_ms': round(_percentile(values, 0.50), 3),
+            'p95_ms': round(_percentile(values, 0.95), 3),
+            'max_ms': round(values[-1], 3),
+        })
+    stats.sort(key=lambda item: item['p95_ms'], reverse=True)
+    return stats
+
+
+def reset():
+    with _lock:
+        _runs.clear()
+        _history.clear()
+
+
+def export_json():
+    items, wall_ms = last_run()
+    return json.dumps({
+        'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'last_run_wall_ms': round(wall_ms, 3) if wall_ms is not None else None,
+        'last_run': items,
+        'rolling': rolling_stats(),
+    }, indent=2)
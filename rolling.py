@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import database as db
+import logic
+from profiling import profiled
+
+# Скользящие метрики по последним N сессиям или N дням. Префиксные суммы
+# считаются один раз на версию данных и фильтр; любое окно — это разность
+# двух префиксов, O(n) без пересчета KPI на каждое окно.
+WINDOW_UNITS = ('sessions', 'days')
+CACHE_SIZE = 8
+
+_lock = threading.Lock()
+_prefix_cache = OrderedDict()
+
+
+def _prefix_sums(df, filters):
+    key = (db.DB_NAME, db.get_data_version(), tuple(sorted((filters or {}).items())))
+    with _lock:
+        if key in _prefix_cache:
+            _prefix_cache.move_to_end(key)
+            return _prefix_cache[key]
+
+    order = np.lexsort((df['id'].to_numpy(), df['date'].to_numpy()))
+    days = df['date'].to_numpy().astype('datetime64[D]')[order]
+    profit = np.round(df['profit'].to_numpy(dtype=np.float64), 2)[order]
+    duration = np.nan_to_num(df['duration_minutes'].to_numpy(dtype=np.float64))[order]
+    starts, ends = logic.session_times(df)
+    if starts is not None:
+        starts, ends = starts[order], ends[order]
+
+    # Реальное время дня делится между его сессиями пропорционально длительности,
+    # чтобы окно по дням давало тот же Hourly Rate, что и KPI
+    unique_days, wall = logic.wall_minutes_by_day(days, duration, starts, ends)
+    day_index = np.searchsorted(unique_days, days)
+    seat = np.bincount(day_index, weights=duration, minlength=len(unique_days))
+    count = np.bincount(day_index, minlength=len(unique_days))
+    share = np.where(seat[day_index] > 0, duration / np.where(seat > 0, seat, 1)[day_index],
+                     1 / count[day_index])
+
+    # Профит центрируется: разность сумм квадратов не теряет точность на длинной истории
+    mean = profit.mean()
+    centered = profit - mean
+    prefix = {
+        'days': days,
+        'mean': mean,
+        'profit': np.r_[0.0, np.cumsum(centered)],
+        'squares': np.r_[0.0, np.cumsum(centered ** 2)],
+        'wins': np.r_[0, np.cumsum(profit > 0)],
+        'minutes': np.r_[0.0, np.cumsum(share * wall[day_index])],
+        # Последняя сессия каждого дня — точки графика
+        'day_ends': np.r_[np.flatnonzero(days[1:] != days[:-1]), len(days) - 1],
+    }
+    with _lock:
+        _prefix_cache[key] = prefix
+        while len(_prefix_cache) > CACHE_SIZE:
+            _prefix_cache.popitem(last=False)
+    return prefix
+
+
+@profiled
+def rolling_metrics(df, window, unit='sessions', filters=None):
+    # Значения на конец каждого игрового дня по окну из window сессий или дней.
+    # Точки, где окно еще не заполнено, отбрасываются (как min_periods в pandas).
+    columns = ['date', 'sessions', 'profit', 'hourly_rate', 'win_rate', 'std']
+    if df.empty or window < 1:
+        return pd.DataFrame(columns=columns)
+
+    prefix = _prefix_sums(df, filters)
+    days = prefix['days']
+    ends = prefix['day_ends']
+    if unit == 'sessions':
+        starts = np.maximum(ends + 1 - window, 0)
+        full = ends + 1 >= window
+    else:
+        starts = np.searchsorted(days, days[ends] - np.timedelta64(window - 1, 'D'), side='left')
+        full = days[ends] >= days[0] + np.timedelta64(window - 1, 'D')
+
+    def window_sum(name):
+        values = prefix[name]
+        return values[ends + 1] - values[starts]
+
+    count = ends + 1 - starts
+    centered = window_sum('profit')
+    profit = centered + prefix['mean'] * count
+    hours = window_sum('minutes') / 60
+    variance = (window_sum('squares') - centered ** 2 / count) / np.maximum(count - 1, 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = pd.DataFrame({
+            'date': days[ends].astype('datetime64[ns]'),
+            'sessions': count,
+            'profit': np.round(profit, 2),
+            'hourly_rate': np.where(hours > 0, profit / hours, np.nan),
+            'win_rate': window_sum('wins') / count * 100,
+            'std': np.where(count > 1, np.sqrt(np.maximum(variance, 0.0)), np.nan),
+        })
+    return result[full].reset_index(drop=True)
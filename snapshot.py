@@ -0,0 +1,189 @@
+import os
+import sys
+import threading
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+
+import database as db
+from profiling import profiled
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow необязателен: без него аналитика читает SQLite
+    pa = pc = pq = None
+
+# Колоночный снимок таблицы sessions для аналитических чтений. Строки отсортированы
+# по (date, id), поэтому фильтр по датам отбрасывает целые row group по статистике.
+# Обновляется по журналу session_changes: перечитываются только измененные сессии.
+ROW_GROUP_SIZE = 64 * 1024
+
+# Если изменилась большая доля истории, снимок дешевле пересобрать целиком
+FULL_REBUILD_RATIO = 0.25
+
+SEQ_KEY = b'poker_tracker.last_seq'
+DB_KEY = b'poker_tracker.db'
+
+_refresh_lock = threading.Lock()
+
+SESSIONS_QUERY = '''
+SELECT id, day as date, room_id, game_type_id, buy_in, cash_out, profit, duration_minutes,
+       CAST(strftime('%s', start_time) AS INTEGER) as start_time,
+       CAST(strftime('%s', end_time) AS INTEGER) as end_time
+FROM sessions
+'''
+
+
+def available():
+    return pq is not None
+
+
+def snapshot_path(db_name=None):
+    return os.path.splitext(db_name or db.DB_NAME)[0] + "_snapshot.parquet"
+
+
+def _schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.timestamp('us')),
+        ('room_id', pa.int64()),
+        ('game_type_id', pa.int64()),
+        ('buy_in', pa.float64()),
+        ('cash_out', pa.float64()),
+        ('profit', pa.float64()),
+        ('duration_minutes', pa.int64()),
+        ('start_time', pa.timestamp('us')),
+        ('end_time', pa.timestamp('us')),
+    ])
+
+
+def _fetch(conn, where="", params=()):
+    df = pd.read_sql_query(SESSIONS_QUERY + where, conn, params=params)
+    df['date'] = db.days_to_dates(df['date'])
+    for name in db.TIME_COLUMNS:
+        df[name] = db.seconds_to_datetimes(df[name])
+    return pa.Table.from_pandas(df, schema=_schema(), preserve_index=False)
+
+
+def _db_id():
+    return os.path.abspath(db.DB_NAME).encode()
+
+
+def _last_seq(path):
+    # None — снимка нет, он собран по другой базе или со старым набором колонок
+    if not os.path.exists(path):
+        return None
+    schema = pq.read_schema(path)
+    metadata = schema.metadata or {}
+    seq = metadata.get(SEQ_KEY)
+    if seq is None or metadata.get(DB_KEY) != _db_id() or schema.names != _schema().names:
+        return None
+    return int(seq)
+
+
+def _write(table, path, seq):
+    table = table.sort_by([('date', 'ascending'), ('id', 'ascending')])
+    table = table.replace_schema_metadata({SEQ_KEY: str(seq).encode(), DB_KEY: _db_id()})
+    # Пишем во временный файл и подменяем: читатели никогда не видят половину снимка
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE, compression='zstd')
+    os.replace(tmp_path, path)
+
+
+@profiled
+def refresh(full=False):
+    # Возвращает число перечитанных из SQLite строк (0 — снимок был актуален)
+    path = snapshot_path()
+    with _refresh_lock, db.connection() as conn:
+        # Номер журнала берется до чтения строк: запись, прошедшая между ними,
+        # просто будет применена повторно при следующем обновлении. Применённые строки
+        # журнала удаляются, поэтому номер — из sqlite_sequence (AUTOINCREMENT его хранит)
+        seq = conn.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence "
+                           "WHERE name = 'session_changes'), 0)").fetchone()[0]
+        current = None if full else _last_seq(path)
+        if current == seq:
+            return 0
+
+        changed = []
+        if current is not None and current < seq:
+            changed = [row[0] for row in conn.execute(
+                "SELECT DISTINCT session_id FROM session_changes WHERE seq > ?", (current,))]
+            total = pq.read_metadata(path).num_rows
+            if db.LOG_RESTART in changed or len(changed) > max(total, 1) * FULL_REBUILD_RATIO:
+                current = None
+
+        if current is None or current > seq:
+            # Снимка нет, он от другой базы, журнал начат заново или изменений слишком много
+            table = _fetch(conn)
+            rows = table.num_rows
+        else:
+            fresh = _fetch(conn, "WHERE id IN (SELECT session_id FROM session_changes WHERE seq > ?)", (current,))
+            table = pq.read_table(path)
+            keep = pc.invert(pc.is_in(table['id'], value_set=pa.array(changed, type=pa.int64())))
+            table = pa.concat_tables([table.filter(keep), fresh])
+            rows = fresh.num_rows
+
+        _write(table, path, seq)
+        conn.execute("DELETE FROM session_changes WHERE seq <= ?", (seq,))
+    return rows
+
+
+def _labels(ids, table, unknown):
+    # Названия подставляются по уникальным id, а не по каждой строке.
+    # Включая удаленные: у старых сессий остается название рума/типа.
+    with db.connection() as conn:
+        names = dict(conn.execute(f"SELECT id, name FROM {table}").fetchall())
+    codes, uniques = pd.factorize(ids, use_na_sentinel=False)
+    labels = [unknown if pd.isna(u) else names.get(int(u), unknown) for u in uniques]
+    categories, inverse = np.unique(np.array(labels, dtype=object), return_inverse=True)
+    return pd.Categorical.from_codes(inverse[codes], categories=categories)
+
+
+@profiled
+def read_sessions(start_date=None, end_date=None, room_id=None, game_type_id=None, columns=None):
+    # Тот же результат, что SQL-ветка database.get_sessions_df (без комментариев)
+    columns = list(columns or [c for c in db.SESSION_COLUMNS if c != 'comments'])
+    refresh()
+
+    filters = []
+    if start_date is not None:
+        filters.append(('date', '>=', datetime.combine(start_date, time())))
+    if end_date is not None:
+        filters.append(('date', '<', datetime.combine(end_date + timedelta(days=1), time())))
+    if room_id is not None:
+        filters.append(('room_id', '=', int(room_id)))
+    if game_type_id is not None:
+        filters.append(('game_type_id', '=', int(game_type_id)))
+
+    needed = {'room': 'room_id', 'game_type': 'game_type_id'}
+    read_columns = list(dict.fromkeys(needed.get(c, c) for c in columns))
+    table = pq.read_table(snapshot_path(), columns=read_columns, filters=filters or None)
+
+    # Журнальный порядок: новые сверху
+    df = table.to_pandas().iloc[::-1].reset_index(drop=True)
+    if 'room' in columns:
+        df['room'] = _labels(df['room_id'], 'rooms', 'Unknown Room')
+    if 'game_type' in columns:
+        df['game_type'] = _labels(df['game_type_id'], 'game_types', 'Unknown Game')
+    return df[columns]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Parquet snapshot of the sessions table")
+    parser.add_argument('--db', default=db.DB_NAME, help="путь к базе")
+    parser.add_argument('command', choices=('refresh', 'rebuild'))
+    args = parser.parse_args()
+
+    if not available():
+        sys.exit("Для снимка нужен pyarrow: pip install pyarrow")
+    db.DB_NAME = args.db
+    db.CHANGE_LOG = True
+    db.init_db()
+    rows = refresh(full=args.command == 'rebuild')
+    print(f"{snapshot_path()}: {rows} rows read from SQLite, "
+          f"{pq.read_metadata(snapshot_path()).num_rows} rows in snapshot")
@@ -0,0 +1,354 @@
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database as db
+from profiling import profiled
+
+# Автоимпорт из папки с логами покер-клиентов. Файлы — JSON Lines, по событию на строку:
+#   {"event": "sit", "client": "PokerStars", "game": "NLH Cash", "table": "Alpha", "time": "...", "buy_in": 100}
+#   {"event": "hand", "client": ..., "game": ..., "table": ..., "time": "...", "net": -2.5}
+#   {"event": "leave", "client": ..., "game": ..., "table": ..., "time": "..."}
+#   {"event": "tournament", "client": ..., "game": "MTT", "start": "...", "end": "...",
+#    "buy_in": 11, "cash_out": 0}
+# Раздачи одного стола складываются в сессию, пока между ними меньше SESSION_GAP
+# и не пришло "leave". Смещение в каждом файле запоминается в базе вместе с
+# записанными сессиями в одной транзакции, поэтому строка не читается дважды.
+POLL_INTERVAL = 2.0
+FILE_PATTERN = "*.jsonl"
+SESSION_GAP = timedelta(minutes=30)
+# Сколько байт читать из одного файла за проход — ограничивает размер транзакции
+MAX_READ_BYTES = 4 * 1024 * 1024
+
+# Названия в логах клиентов -> названия румов и типов игр в трекере
+ROOM_ALIASES = {
+    'pokerstars': 'PokerStars',
+    'stars': 'PokerStars',
+    'ggpoker': 'GGPoker',
+    'gg': 'GGPoker',
+    'natural8': 'GGPoker',
+    '888': '888poker',
+    'party': 'partypoker',
+    'acr': 'ACR',
+    'americas cardroom': 'ACR',
+}
+
+GAME_TYPE_ALIASES = {
+    'nlh cash': 'Cash',
+    'plo cash': 'PLO Cash',
+    'cash game': 'Cash',
+    'tournament': 'MTT',
+    'mtt': 'MTT',
+    'spin & go': 'Spin&Go',
+    'spin': 'Spin&Go',
+}
+
+
+def init_ingest_tables():
+    with db.transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS ingest_files (
+                path TEXT PRIMARY KEY,
+                inode INTEGER NOT NULL,
+                offset INTEGER NOT NULL
+            )''')
+        # Сессии столов, которые еще идут: переживают перезапуск watcher
+        conn.execute('''CREATE TABLE IF NOT EXISTS ingest_open_sessions (
+                key TEXT PRIMARY KEY,
+                client TEXT NOT NULL,
+                game TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                start_time TEXT NOT NULL,
+                last_time TEXT NOT NULL,
+                buy_in REAL NOT NULL,
+                net REAL NOT NULL,
+                min_net REAL NOT NULL,
+                hands INTEGER NOT NULL
+            )''')
+
+
+def _read_new_lines(path, inode, offset):
+    # Возвращает (строки, новое смещение); незаконченная последняя строка ждет следующего прохода
+    stat = os.stat(path)
+    if stat.st_ino != inode or stat.st_size < offset:
+        # Файл заменили или обрезали — читаем заново
+        offset = 0
+    if stat.st_size == offset:
+        return [], stat.st_ino, offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(MAX_READ_BYTES)
+    end = data.rfind(b'\n') + 1
+    return data[:end].splitlines(), stat.st_ino, offset + end
+
+
+def _parse(line):
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or 'event' not in event:
+        return None
+    return event
+
+
+def _timestamp(value):
+    # Время из лога -> локальное время без часового пояса, как datetime.now() и
+    # start_time/end_time в базе. Время с поясом переводится в локальное.
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def _new_session(event, time_):
+    return {
+        'client': event.get('client', 'Unknown'),
+        'game': event.get('game', 'Unknown'),
+        'table_name': event.get('table', ''),
+        'start_time': time_,
+        'last_time': time_,
+        'buy_in': 0.0,
+        'net': 0.0,
+        'min_net': 0.0,
+        'hands': 0,
+    }
+
+
+def _session_row(state):
+    # Без событий "sit" бай-ин — самая глубокая просадка внутри сессии,
+    # чтобы cash-out не уходил в минус
+    buy_in = state['buy_in'] or max(0.0, -state['min_net'])
+    start, end = state['start_time'], state['last_time']
+    return {
+        'client': state['client'],
+        'game': state['game'],
+        'start_time': start,
+        'end_time': end,
+        'buy_in': round(buy_in, 2),
+        'cash_out': round(buy_in + state['net'], 2),
+        'duration': max(1, int((end - start).total_seconds() // 60)),
+        'comments': f"{state['table_name']} · {state['hands']} hands (auto)".strip(' ·'),
+    }
+
+
+def _apply(event, open_sessions, finished):
+    kind = event['event']
+    if kind == 'tournament':
+        start = _timestamp(event['start'])
+        end = _timestamp(event.get('end', event['start']))
+        buy_in = float(event.get('buy_in', 0))
+        finished.append({
+            'client': event.get('client', 'Unknown'),
+            'game': event.get('game', 'MTT'),
+            'start_time': start,
+            'end_time': end,
+            'buy_in': buy_in,
+            'cash_out': float(event.get('cash_out', 0)),
+            'duration': max(1, int((end - start).total_seconds() // 60)),
+            'comments': f"{event.get('name', '')} (auto)".strip(),
+        })
+        return
+
+    time_ = _timestamp(event['time'])
+    key = f"{event.get('client')}|{event.get('game')}|{event.get('table')}"
+    state = open_sessions.get(key)
+    if state is not None and time_ - state['last_time'] > SESSION_GAP:
+        finished.append(_session_row(open_sessions.pop(key)))
+        state = None
+
+    if kind == 'leave':
+        if state is not None:
+            state['last_time'] = max(state['last_time'], time_)
+            finished.append(_session_row(open_sessions.pop(key)))
+        return
+    if state is None:
+        state = open_sessions[key] = _new_session(event, time_)
+    state['last_time'] = max(state['last_time'], time_)
+    if kind == 'sit':
+        state['buy_in'] += float(event.get('buy_in', 0))
+    elif kind == 'hand':
+        state['net'] += float(event.get('net', 0))
+        state['min_net'] = min(state['min_net'], state['net'])
+        state['hands'] += 1
+
+
+def _resolve(conn, table, name, aliases, cache):
+    # Точное имя без учета регистра, затем алиас; неизвестное название создается
+    key = name.strip().lower()
+    if key in cache:
+        return cache[key]
+    for candidate in (name.strip(), aliases.get(key)):
+        if candidate is None:
+            continue
+        row = conn.execute(f"SELECT id FROM {table} WHERE deleted_at IS NULL AND lower(name) = lower(?) "
+                           "ORDER BY id LIMIT 1", (candidate,)).fetchone()
+        if row is not None:
+            cache[key] = row[0]
+            return row[0]
+    cache[key] = conn.execute(f"INSERT INTO {table} (name) VALUES (?)",
+                              (aliases.get(key, name.strip()),)).lastrowid
+    return cache[key]
+
+
+def _load_open_sessions(conn):
+    rows = conn.execute('''SELECT key, client, game, table_name, start_time, last_time,
+                                  buy_in, net, min_net, hands
+                           FROM ingest_open_sessions''').fetchall()
+    return {
+        key: {
+            'client': client, 'game': game, 'table_name': table_name,
+            'start_time': _timestamp(start), 'last_time': _timestamp(last),
+            'buy_in': buy_in, 'net': net, 'min_net': min_net, 'hands': hands,
+        }
+        for key, client, game, table_name, start, last, buy_in, net, min_net, hands in rows
+    }
+
+
+@profiled
+def poll_once(directory, pattern=FILE_PATTERN, now=None):
+    # Один проход по папке; возвращает число записанных сессий
+    now = now or datetime.now()
+    with db.connection() as conn:
+        offsets = {path: (inode, offset)
+                   for path, inode, offset in conn.execute("SELECT path, inode, offset FROM ingest_files")}
+        open_sessions = _load_open_sessions(conn)
+
+    events = []
+    new_offsets = {}
+    for path in sorted(glob.glob(os.path.join(directory, pattern))):
+        path = os.path.abspath(path)
+        inode, offset = offsets.get(path, (None, 0))
+        lines, inode, new_offset = _read_new_lines(path, inode, offset)
+        if new_offset != offset or path not in offsets:
+            new_offsets[path] = (inode, new_offset)
+        events.extend(event for event in map(_parse, lines) if event is not None)
+
+    idle = [key for key, state in open_sessions.items() if now - state['last_time'] > SESSION_GAP]
+    if not events and not idle and not new_offsets:
+        # Ничего нового: без транзакции, чтобы не сбрасывать кэш чтений приложения
+        return 0
+
+    finished = []
+    for event in events:
+        try:
+            _apply(event, open_sessions, finished)
+        except (KeyError, ValueError, TypeError):
+            continue
+    for key, state in list(open_sessions.items()):
+        if now - state['last_time'] > SESSION_GAP:
+            finished.append(_session_row(open_sessions.pop(key)))
+
+    # Смещения и незакрытые столы — служебное состояние: версия данных растет (и кэши
+    # приложения сбрасываются) только когда в sessions добавляются строки
+    with db.transaction(bump=bool(finished)) as conn:
+        room_cache, type_cache = {}, {}
+        rows = []
+        for s in finished:
+            rows.append((
+                s['start_time'].strftime('%Y-%m-%d'),
+                _resolve(conn, 'rooms', s['client'], ROOM_ALIASES, room_cache),
+                _resolve(conn, 'game_types', s['game'], GAME_TYPE_ALIASES, type_cache),
+                s['buy_in'], s['cash_out'], round(s['cash_out'] - s['buy_in'], 2),
+                s['duration'], s['comments'],
+                s['start_time'].strftime('%Y-%m-%d %H:%M:%S'), s['end_time'].strftime('%Y-%m-%d %H:%M:%S'),
+            ))
+        if rows:
+            conn.executemany('''INSERT INTO sessions
+                     (date, room_id, game_type_id, buy_in, cash_out, profit, duration_minutes, comments,
+                      start_time, end_time)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+            db.repair_balances((min(row[0] for row in rows), 0), conn=conn)
+
+        conn.execute("DELETE FROM ingest_open_sessions")
+        conn.executemany('''INSERT INTO ingest_open_sessions
+                 (key, client, game, table_name, start_time, last_time, buy_in, net, min_net, hands)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         [(key, s['client'], s['game'], s['table_name'],
+                           s['start_time'].isoformat(sep=' '), s['last_time'].isoformat(sep=' '),
+                           s['buy_in'], s['net'], s['min_net'], s['hands'])
+                          for key, s in open_sessions.items()])
+        conn.executemany('''INSERT INTO ingest_files (path, inode, offset) VALUES (?, ?, ?)
+                 ON CONFLICT (path) DO UPDATE SET inode = excluded.inode, offset = excluded.offset''',
+                         [(path, inode, offset) for path, (inode, offset) in new_offsets.items()])
+    return len(rows)
+
+
+class Watcher:
+    # Фоновый поток: опрашивает папку раз в interval секунд, пока не вызван stop()
+    def __init__(self, directory, pattern=FILE_PATTERN, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.pattern = pattern
+        self.interval = interval
+        self.sessions_written = 0
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"watcher:{directory}", daemon=True)
+
+    def start(self):
+        init_ingest_tables()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sessions_written += poll_once(self.directory, self.pattern)
+                self.last_error = None
+            except Exception as e:
+                # Битый файл или занятая база не должны останавливать импорт
+                self.last_error = str(e)
+            self._stop.wait(self.interval)
+
+
+_watchers_lock = threading.Lock()
+_watchers = {}
+
+
+def start_background(directory, pattern=FILE_PATTERN, interval=POLL_INTERVAL):
+    # Streamlit перезапускает скрипт на каждое действие — поток на папку создается один раз
+    key = (os.path.abspath(directory), db.DB_NAME)
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None or not watcher.is_alive():
+            watcher = _watchers[key] = Watcher(directory, pattern, interval).start()
+    return watcher
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import sessions from poker client logs as they are written")
+    parser.add_argument('directory')
+    parser.add_argument('--db', default=db.DB_NAME, help="путь к базе")
+    parser.add_argument('--pattern', default=FILE_PATTERN)
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL)
+    parser.add_argument('--once', action='store_true', help="один проход и выход")
+    args = parser.parse_args()
+
+    db.DB_NAME = args.db
+    db.init_db()
+    init_ingest_tables()
+    if args.once:
+        print(f"{poll_once(args.directory, args.pattern)} sessions written")
+        sys.exit(0)
+
+    print(f"Watching {args.directory} ({args.pattern}) every {args.interval}s, Ctrl+C to stop")
+    try:
+        while True:
+            written = poll_once(args.directory, args.pattern)
+            if written:
+                print(f"{time.strftime('%H:%M:%S')} +{written} sessions")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
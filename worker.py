@@ -0,0 +1,202 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Any
+
+import database as db
+import logic
+from profiling import profiled
+
+# Фоновый пересчет дашборда. Каждая запись в базу ставит в очередь задание с новой
+# версией данных; поток пересчитывает статистику и агрегаты — сначала для фильтров,
+# открытых в интерфейсе, затем для остальных стандартных периодов последних
+# просмотренных румов/типов. Интерфейс берет готовый снимок, а для произвольного
+# диапазона дат или еще не посчитанных фильтров — считает сам, как раньше.
+PRESETS = ("Все время", "Последние 30 дней", "Текущий год")
+
+# Сколько сочетаний рум × тип игры держать посчитанными (по последнему просмотру)
+MAX_SCOPES = 4
+
+# Сколько интерфейс ждет снимок, который поток считает прямо сейчас, прежде чем считать сам
+WAIT_SECONDS = 5.0
+
+
+def preset_range(name, today=None):
+    # (start_date, end_date) периода из сайдбара; None — без ограничения
+    today = today or date.today()
+    if name == "Последние 30 дней":
+        return today - timedelta(days=30), today
+    if name == "Текущий год":
+        return date(today.year, 1, 1), today
+    return None, None
+
+
+@dataclass(frozen=True)
+class DashboardData:
+    version: int
+    df: Any
+    stats: logic.DashboardStats
+    kpi: dict
+    cumulative: Any
+    monthly: Any
+    by_room: Any
+    by_game_type: Any
+
+
+@profiled
+def compute(filters):
+    # Все, что рисует вкладка «Аналитика», для одного набора фильтров
+    version = db.get_data_version()
+    df = db.get_sessions_df(**filters, columns=logic.DASHBOARD_COLUMNS)
+    return DashboardData(
+        version=version,
+        df=df,
+        stats=logic.compute_dashboard_stats(df, mtt_type_ids=db.game_type_registry().ids_named('MTT')),
+        kpi=db.get_kpi_totals(**filters),
+        cumulative=db.get_cumulative_profit(**filters),
+        monthly=db.get_profit_by_month(**filters),
+        by_room=db.get_profit_by_room(**filters),
+        by_game_type=db.get_profit_by_game_type(**filters),
+    )
+
+
+def _key(filters):
+    return (db.DB_NAME, tuple(sorted(filters.items())))
+
+
+_lock = threading.Condition()
+_jobs = queue.Queue()
+_snapshots = {}
+_scopes = OrderedDict({(None, None): None})
+_requested = None
+_computing = None
+_thread = None
+last_error = None
+log = logging.getLogger(__name__)
+
+
+def _targets(today=None):
+    # Фильтры, открытые в интерфейсе последними, — первыми, дальше остальные
+    # периоды последних просмотренных румов/типов
+    targets = []
+    for room_id, game_type_id in reversed(list(_scopes)):
+        for name in PRESETS:
+            start_date, end_date = preset_range(name, today)
+            targets.append({'start_date': start_date, 'end_date': end_date,
+                            'room_id': room_id, 'game_type_id': game_type_id})
+    if _requested in targets:
+        targets.remove(_requested)
+        targets.insert(0, _requested)
+    return targets
+
+
+def _on_data_change(version):
+    # Вызывается только когда данные действительно изменились
+    _jobs.put(version)
+
+
+def _run():
+    global _computing, last_error
+    while True:
+        _jobs.get()
+        # Несколько записей подряд — считаем один раз, по последней версии
+        while True:
+            try:
+                _jobs.get_nowait()
+            except queue.Empty:
+                break
+        with _lock:
+            targets = _targets()
+            # Снимки вчерашних периодов и забытых фильтров больше не нужны
+            keep = {_key(filters) for filters in targets}
+            for key in [key for key in _snapshots if key not in keep]:
+                del _snapshots[key]
+        try:
+            for filters in targets:
+                if not _jobs.empty():
+                    # Пока считали, данные снова изменились — результат уже устарел
+                    break
+                with _lock:
+                    if _fresh(filters) is not None:
+                        # Уже посчитано интерфейсом
+                        continue
+                    _computing = _key(filters)
+                data = compute(filters)
+                _store(filters, data)
+            last_error = None
+        except Exception as e:
+            # Поток не останавливается: интерфейс посчитает сам,
+            # следующая запись запустит задание снова
+            last_error = str(e)
+            log.exception("Фоновый пересчет дашборда не удался")
+        finally:
+            with _lock:
+                _computing = None
+                _lock.notify_all()
+
+
+def start():
+    # Один поток на процесс: Streamlit перезапускает скрипт на каждое действие.
+    # Задания ставятся только записью в базу; до первой записи снимки
+    # появляются из расчетов самого интерфейса.
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_run, name="dashboard-worker", daemon=True)
+        _thread.start()
+        db.add_data_listener(_on_data_change)
+
+
+def _fresh(filters):
+    data = _snapshots.get(_key(filters))
+    return data if data is not None and data.version == db.get_data_version() else None
+
+
+def _store(filters, data):
+    # Снимок сохраняется, только если фильтры отслеживаются и данные за время
+    # расчета не изменились
+    with _lock:
+        if data.version == db.get_data_version() and filters in _targets():
+            _snapshots[_key(filters)] = data
+        _lock.notify_all()
+
+
+def snapshot(filters, wait=WAIT_SECONDS):
+    # Готовый снимок для текущей версии данных или None, если его нет.
+    # Ждем до wait секунд, только если поток считает именно эти фильтры.
+    global _requested
+    scope = (filters.get('room_id'), filters.get('game_type_id'))
+    with _lock:
+        _requested = dict(filters)
+        if scope in _scopes:
+            _scopes.move_to_end(scope)
+        else:
+            # Новое сочетание: считается на месте, при следующей записи — в фоне
+            _scopes[scope] = None
+            while len(_scopes) > MAX_SCOPES:
+                _scopes.popitem(last=False)
+
+        deadline = time.monotonic() + wait
+        while True:
+            data = _fresh(filters)
+            if data is not None:
+                return data
+            remaining = deadline - time.monotonic()
+            if _computing != _key(filters) or remaining <= 0:
+                return None
+            _lock.wait(remaining)
+
+
+def dashboard_data(filters):
+    # Снимок из фонового потока, а если его нет — расчет на месте
+    # (результат для отслеживаемых фильтров сохраняется как снимок)
+    data = snapshot(filters)
+    if data is None:
+        data = compute(filters)
+        _store(filters, data)
+    return data